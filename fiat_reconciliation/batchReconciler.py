@@ -0,0 +1,167 @@
+# Bills several periods in one run, spreading the work over every core.
+# This script requires the same 4 parameters as fiatReconciler.py:
+#     pool_name   -  The name of the pool you created to attach to the
+#       Sovrin Network (pool must already exist)
+#     wallet_name -  The name of the wallet containing the DID used to
+#       send ledger requests (wallet must already exist)
+#     wallet_key  -  The secret key of <wallet_name>
+#     signing_did -  The DID with sufficient rights to run
+#       get-validator-info (must already be in the wallet <wallet_name>)
+# followed by one or more periods written as start_date,end_date
+
+from fiatReconciler import getTimestamp, getFiatFees, calculateBills, \
+    outputBillsFile
+import ledger_query as lq
+from local_ledger import LocalLedger
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import argparse
+import os
+
+# Each worker process opens its own read-only handle to the local ledger
+_workerLedger = None
+
+
+# Handles and parses all arguments, returning them
+def parseArgs():
+    helpTxt = 'You may optionally place each argument, line by line, in a\
+        file, then read arguments from that file as so: \
+        "python3 file.py @argumentFile.txt"'
+    parser = argparse.ArgumentParser(fromfile_prefix_chars='@', epilog=helpTxt)
+    parser.add_argument("pool_name", help="the pool you want to connect to.")
+    parser.add_argument("wallet_name", help="wallet name to be used")
+    parser.add_argument("wallet_key", help="wallet key for opening the wallet")
+    parser.add_argument(
+        "signing_did", help="did used to sign requests sent to the ledger")
+    parser.add_argument(
+        "periods", nargs='+', help="periods to bill, each written as "
+        "mm-dd-yyyy,mm-dd-yyyy (start and end date)")
+    parser.add_argument(
+        "--database_dir", help="which database dir to use",
+        default="ledger_copy.db")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="number of worker processes (default: one per core)")
+    parser.add_argument(
+        "--no_update", action='store_true',
+        help="bill from the local ledger as it is, without syncing first")
+    return parser.parse_args()
+
+
+# Converts "start,end" period strings into (startTimestamp, endTimestamp)
+def parsePeriods(periods):
+    parsed = []
+    for period in periods:
+        dates = period.split(',')
+        if len(dates) != 2:
+            raise ValueError('Period must be written as start,end: ' + period)
+        startTimestamp = getTimestamp(dates[0].strip())
+        endTimestamp = getTimestamp(dates[1].strip())
+        if startTimestamp > endTimestamp:
+            raise ValueError('Start timestamp must be before end timestamp: '
+                             + period)
+        parsed.append((startTimestamp, endTimestamp))
+    return parsed
+
+
+# Connects to the specified ledger and updates it until the latest txn
+# has been downloaded
+async def updateLocalLedger(args):
+    with LocalLedger(args.database_dir, args.pool_name, args.wallet_name,
+                     args.wallet_key, args.signing_did) as ll:
+        await ll.connect()
+        await ll.update()
+        await ll.updatePaymentIndex()
+        await ll.disconnect()
+
+
+# Splits the seqNo range of every period into chunks of at most chunkSize
+# txns. Returns a list of (periodIndex, startSeqNo, endSeqNo).
+def splitSeqNoRanges(seqNoRanges, chunkSize):
+    chunks = []
+    for i, (startSeqNo, endSeqNo) in enumerate(seqNoRanges):
+        if startSeqNo is None or endSeqNo is None:
+            continue
+        curSeqNo = startSeqNo
+        while curSeqNo <= endSeqNo:
+            chunkEnd = min(curSeqNo + chunkSize - 1, endSeqNo)
+            chunks.append((i, curSeqNo, chunkEnd))
+            curSeqNo = chunkEnd + 1
+    return chunks
+
+
+# Adds the bills of one chunk into the bills of its period
+def mergeBills(bills, chunkBills):
+    for did, amounts in chunkBills.items():
+        if did not in bills:
+            bills[did] = amounts
+        else:
+            bills[did] = [x + y for x, y in zip(bills[did], amounts)]
+    return bills
+
+
+def _initWorker(databaseDir):
+    global _workerLedger
+    _workerLedger = LocalLedger(databaseDir, None, None, None, None,
+                                readOnly=True)
+
+
+def _billChunk(feesByTimePeriod, chunk):
+    periodIndex, startSeqNo, endSeqNo = chunk
+    txns = lq.getTxnRange(_workerLedger, startSeqNo=startSeqNo,
+                          endSeqNo=endSeqNo)
+    return periodIndex, calculateBills(feesByTimePeriod, txns,
+                                       _workerLedger.isTokenPaid)
+
+
+# Bills every period, running the chunks of all periods on a process pool,
+# and returns a list with the bills dict of each period
+def billPeriods(databaseDir, feesByTimePeriod, periods, workers):
+    with LocalLedger(databaseDir, None, None, None, None,
+                     readOnly=True) as ll:
+        seqNoRanges = [lq.getSeqNoRange(ll, startTimestamp, endTimestamp)
+                       for startTimestamp, endTimestamp in periods]
+
+    # several chunks per worker keeps every core busy even when the periods
+    # differ a lot in size
+    totalTxns = sum(endSeqNo - startSeqNo + 1
+                    for startSeqNo, endSeqNo in seqNoRanges
+                    if startSeqNo is not None and endSeqNo >= startSeqNo)
+    chunkSize = max(1, -(-totalTxns // (workers * 4)))
+    chunks = splitSeqNoRanges(seqNoRanges, chunkSize)
+
+    billsByPeriod = [{} for _ in periods]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                             initargs=(databaseDir,)) as executor:
+        futures = [executor.submit(_billChunk, feesByTimePeriod, chunk)
+                   for chunk in chunks]
+        for future in futures:
+            periodIndex, chunkBills = future.result()
+            mergeBills(billsByPeriod[periodIndex], chunkBills)
+    return billsByPeriod
+
+
+async def run(args):
+    if args.workers < 1:
+        raise ValueError('At least one worker is required')
+    periods = parsePeriods(args.periods)
+
+    if not args.no_update:
+        await updateLocalLedger(args)
+
+    # retrieve fiat fees once for every period
+    feesByTimePeriod = getFiatFees()
+
+    billsByPeriod = billPeriods(args.database_dir, feesByTimePeriod, periods,
+                                args.workers)
+    for (startTimestamp, endTimestamp), bills in zip(periods, billsByPeriod):
+        outputBillsFile(startTimestamp, endTimestamp, bills)
+
+
+if __name__ == '__main__':
+    args = parseArgs()
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run(args))
+    except KeyboardInterrupt:
+        pass
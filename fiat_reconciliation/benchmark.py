@@ -0,0 +1,155 @@
+# Regression check and benchmark for fiatReconciler billing. Builds a synthetic
+# ledger (a dict of transactions, which ledger_query accepts in place of a
+# LocalLedger) and a synthetic fee schedule whose fees change in the middle of
+# the billed period, then
+#   - checks calculateBills against a simple reference implementation
+#   - times getTxnRange and calculateBills for each ledger size
+# No pool, wallet or network access is needed.
+#
+# Run with: python3 benchmark.py [--sizes 10000,100000,1000000] [--seed 1]
+
+from fiatReconciler import calculateBills, parseFiatFees, nymTxn, attribTxn, \
+    schemaTxn, credDefTxn
+from transaction import Transaction
+import ledger_query as lq
+import argparse
+import math
+import random
+import time
+from datetime import datetime
+
+billedTypes = [nymTxn, attribTxn, schemaTxn, credDefTxn]
+# position of each txn type's amount in a bill list
+billColumn = {nymTxn: 1, attribTxn: 2, schemaTxn: 3, credDefTxn: 4}
+
+# the synthetic ledger starts here and writes one txn every txnInterval seconds
+ledgerStart = 1546300800  # 2019-01-01 00:00:00 UTC
+txnInterval = 30
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", default="10000,100000,1000000",
+        help="comma separated numbers of transactions to benchmark")
+    parser.add_argument(
+        "--seed", type=int, default=1, help="seed for the synthetic data")
+    parser.add_argument(
+        "--dids", type=int, default=1000,
+        help="number of distinct transaction authors")
+    parser.add_argument(
+        "--tokenPaid", type=float, default=0.1,
+        help="fraction of transactions whose fees are paid with tokens")
+    return parser.parse_args()
+
+
+# Creates a dict of key: seqNo, val: Transaction in the format downloaded by
+# LocalLedger, with one txn every txnInterval seconds from ledgerStart
+def makeLedger(size, didCount, rng):
+    dids = ['did' + str(i).zfill(19) for i in range(didCount)]
+    ledger = {}
+    for seqNo in range(1, size + 1):
+        ledger[seqNo] = Transaction({
+            'txn': {
+                'type': rng.choice(billedTypes),
+                'metadata': {'from': rng.choice(dids)}
+            },
+            'txnMetadata': {
+                'seqNo': seqNo,
+                'txnTime': ledgerStart + seqNo * txnInterval
+            }
+        })
+    return ledger
+
+
+# Creates the lines of a fees csv file (see getFiatFees) with a fee change
+# every changeInterval seconds, starting before the ledger does
+def makeFeeLines(ledgerEnd, changes, rng):
+    lines = ['Date,Label,Nym,Attrib,Schema,CredDef,RevocReg,RevocRegUpdate\n']
+    changeInterval = max(1, (ledgerEnd - ledgerStart) // changes)
+    for i in range(changes + 1):
+        # the first schedule starts one day before the first txn
+        timestamp = ledgerStart - 86400 + i * changeInterval
+        date = datetime.utcfromtimestamp(timestamp).strftime('%m/%d/%Y')
+        fees = [rng.choice([0, 1, 5, 10, 25, 50]) for _ in range(4)]
+        lines.append(date + ',fees ' + str(i) + ',' +
+                     ','.join(str(f) for f in fees) + ',0,0\n')
+    return lines
+
+
+# Straightforward version of calculateBills used to check it: looks up the
+# fee in effect for every txn with a linear scan over the schedule
+def referenceBills(feesByTimePeriod, txns, tokenPaid):
+    schedule = sorted(feesByTimePeriod.items())
+    bills = {}
+    for seqNo, txn in txns.items():
+        if seqNo in tokenPaid or txn.getTime() is None:
+            continue
+        did = txn.getSenderDid()
+        if did is None:
+            continue
+        fees = None
+        for timestamp, scheduleFees in schedule:
+            if timestamp <= txn.getTime():
+                fees = scheduleFees
+        fee = fees[txn.getType()]
+        bill = bills.setdefault(did, [0] * 7)
+        bill[0] += fee
+        bill[billColumn[txn.getType()]] += fee
+    return bills
+
+
+def billsMatch(bills, expected):
+    if bills.keys() != expected.keys():
+        return False
+    for did, amounts in expected.items():
+        for x, y in zip(bills[did], amounts):
+            if not math.isclose(x, y):
+                return False
+    return True
+
+
+def benchmark(size, args, rng):
+    ledger = makeLedger(size, args.dids, rng)
+    ledgerEnd = ledgerStart + size * txnInterval
+    feesByTimePeriod = parseFiatFees(makeFeeLines(ledgerEnd, 6, rng))
+    tokenPaid = {seqNo for seqNo in ledger if rng.random() < args.tokenPaid}
+
+    # bill the middle half of the ledger, so the range has to be searched for
+    # and several fee changes fall inside it
+    startTime = ledgerStart + (size // 4) * txnInterval
+    endTime = ledgerStart + (3 * size // 4) * txnInterval
+
+    begin = time.perf_counter()
+    txns = lq.getTxnRange(ledger, startTime=startTime, endTime=endTime)
+    rangeSeconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    bills = calculateBills(feesByTimePeriod, txns, tokenPaid.__contains__)
+    billSeconds = time.perf_counter() - begin
+
+    expected = referenceBills(feesByTimePeriod, txns, tokenPaid)
+    return len(txns), rangeSeconds, billSeconds, billsMatch(bills, expected)
+
+
+def main():
+    args = parseArgs()
+    sizes = [int(s) for s in args.sizes.split(',')]
+    rng = random.Random(args.seed)
+
+    print('{:>10} {:>10} {:>12} {:>12} {:>12} {:>8}'.format(
+        'ledger', 'billed', 'range (s)', 'billing (s)', 'txns/s', 'correct'))
+    allCorrect = True
+    for size in sizes:
+        count, rangeSeconds, billSeconds, correct = benchmark(size, args, rng)
+        allCorrect = allCorrect and correct
+        print('{:>10} {:>10} {:>12.3f} {:>12.3f} {:>12.0f} {:>8}'.format(
+            size, count, rangeSeconds, billSeconds,
+            count / billSeconds if billSeconds else float('inf'), str(correct)))
+
+    if not allCorrect:
+        raise SystemExit('calculateBills does not match the reference')
+
+
+if __name__ == '__main__':
+    main()
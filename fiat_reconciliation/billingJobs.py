@@ -0,0 +1,145 @@
+import asyncio
+import time
+import uuid
+from fiatReconciler import getTimestamp
+
+'''
+Queues billing requests coming from the web server and runs them on a small,
+bounded pool of asyncio workers so that a long ledger sync never blocks the
+request handlers.
+
+Requests for the same time range that are still waiting or running are
+coalesced into one job, so pressing "Calculate" twice does not bill twice.
+'''
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job():
+    '''A single billing request and its current state'''
+
+    def __init__(self, startDate, endDate, key):
+        self.id = uuid.uuid4().hex
+        self.startDate = startDate
+        self.endDate = endDate
+        self.key = key
+        self.status = QUEUED
+        self.error = None
+        self.bills = None
+        self.ledgerTip = None
+        self.created = time.time()
+        self.finished = None
+
+    def asDict(self):
+        return {
+            'id': self.id,
+            'startdate': self.startDate,
+            'enddate': self.endDate,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+            'ledgerTip': self.ledgerTip
+        }
+
+
+class JobQueue():
+    '''
+    Runs billing jobs on a fixed number of workers.
+    runner: coroutine function called as runner(startDate, endDate) which
+        returns (bills dict, ledger tip it was computed against)
+    workers: number of jobs allowed to run at the same time
+    maxFinished: number of finished jobs kept around for status and download
+        requests; the oldest ones are forgotten first
+    '''
+
+    def __init__(self, runner, workers=1, maxFinished=100):
+        if workers < 1:
+            raise Exception('At least one worker is required')
+        self.runner = runner
+        self.workers = workers
+        self.maxFinished = maxFinished
+        self._jobs = {}
+        self._pending = {}
+        self._finished = []
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        '''Starts the worker tasks on the running event loop'''
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.ensure_future(self._worker())
+                       for _ in range(self.workers)]
+
+    async def stop(self):
+        '''Cancels the worker tasks. Jobs still queued are dropped.'''
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, startDate, endDate):
+        '''
+        Enqueues a billing job for the range and returns it. If a job for the
+        same range is already queued or running, that job is returned instead.
+        Raises ValueError if either date cannot be parsed.
+        '''
+        startTimestamp = getTimestamp(startDate)
+        endTimestamp = getTimestamp(endDate)
+        if startTimestamp > endTimestamp:
+            raise ValueError('Start timestamp must be before end timestamp')
+
+        key = (startTimestamp, endTimestamp)
+        job = self._pending.get(key)
+        if job is not None:
+            return job
+
+        job = Job(startDate, endDate, key)
+        self._jobs[job.id] = job
+        self._pending[key] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def getJob(self, jobId):
+        '''Returns the job with the given id, or None if it is unknown'''
+        return self._jobs.get(jobId)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._runJob(job)
+            finally:
+                self._queue.task_done()
+
+    async def _runJob(self, job):
+        job.status = RUNNING
+        try:
+            job.bills, job.ledgerTip = await self.runner(job.startDate,
+                                                         job.endDate)
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = 'Cancelled'
+            raise
+        except ValueError as e:
+            job.status = FAILED
+            job.error = 'Wrong date formatting: ' + str(e)
+        except Exception as e:
+            # a failed job must never take the server down with it
+            print('Billing job', job.id, 'failed:', repr(e))
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            self._pending.pop(job.key, None)
+            self._finished.append(job)
+            self._forgetOldJobs()
+
+    def _forgetOldJobs(self):
+        while len(self._finished) > self.maxFinished:
+            old = self._finished.pop(0)
+            self._jobs.pop(old.id, None)
@@ -15,6 +15,8 @@ import ledger_query as lq
 from local_ledger import LocalLedger
 import asyncio
 import argparse
+import os
+import tempfile
 import time
 from datetime import datetime
 import urllib.request
@@ -66,16 +68,54 @@ def getTimestamp(dateStr):
 
 
 # Connects to the specified ledger and updates it until the latest txn
-# has been downloaded
+# has been downloaded. Returns the txns in the range and the set of seqNos
+# among them whose fees were paid with tokens.
 async def loadTxnsLocally(args, startTimestamp, endTimestamp):
     with LocalLedger(args.database_dir, args.pool_name, args.wallet_name,
                      args.wallet_key, args.signing_did) as ll:
-        # first updates the local ledger database
+        # first updates the local ledger database and payment index
         await ll.connect()
         await ll.update()
+        await ll.updatePaymentIndex()
         await ll.disconnect()
-    
-        return lq.getTxnRange(ll, startTime=startTimestamp, endTime=endTimestamp)
+
+        txns = lq.getTxnRange(ll, startTime=startTimestamp,
+                              endTime=endTimestamp) or {}
+        tokenPaid = {seqNo for seqNo in txns if ll.isTokenPaid(seqNo)}
+        return txns, tokenPaid
+
+
+# Returns (seqNo, timestamp) of the newest txn stored in the local ledger, or
+# (0, None) if nothing has been downloaded yet. If seqNo is given, the tip is
+# taken to be that txn instead.
+def getLedgerTip(ll, seqNo=None):
+    if seqNo is None:
+        seqNo = ll.getTxnCount()
+    if seqNo == 0:
+        return 0, None
+    txn = ll.getTxn(seqNo)
+    if txn is None:
+        return seqNo, None
+    return seqNo, txn.getTime()
+
+
+# Bills a time range using only what is already stored in the local ledger
+# and returns the bills dict (see calculateBills). Nothing is downloaded here;
+# the caller is responsible for keeping ll and its payment index synced.
+# maxSeqNo: ignore txns after this one, e.g. those downloaded after the
+#     payment index was last brought up to date
+def billFromLocalLedger(ll, feesByTimePeriod, startTimestamp, endTimestamp,
+                        maxSeqNo=None):
+    startSeqNo, endSeqNo = lq.getSeqNoRange(ll, startTimestamp, endTimestamp)
+    # the local ledger is still empty
+    if startSeqNo is None:
+        return {}
+    if maxSeqNo is not None:
+        endSeqNo = min(endSeqNo, maxSeqNo)
+    if endSeqNo < startSeqNo:
+        return {}
+    txns = lq.getTxnRange(ll, startSeqNo=startSeqNo, endSeqNo=endSeqNo)
+    return calculateBills(feesByTimePeriod, txns, ll.isTokenPaid)
 
 
 # TODO: fix so this works when using fees that update over time
@@ -127,20 +167,46 @@ def printFeesInPeriod(txns, txnsByType, fees, startTimestamp, endTimestamp):
             '\tTotal fees to be collected:', str(totalCDCost))
 
 
-# Gets all the txns in the time period starting with startTimestamp and
-# ending with endTimestamp, calculates how much every DID owner owes
-# from that period (based on type and number of txns written), and prints this
-# info to a csv file.
-def outputBillsFile(startTimestamp, endTimestamp, bills):
+# Yields the bill of every DID as one csv line, sorted by DID. This is the
+# same content that outputBillsFile writes, so reports can be streamed
+# without touching the disk.
+def billRows(bills):
+    for key, value in sorted(bills.items()):
+        yield str(key) + ',' + ",".join(str(x) for x in value) + '\n'
+
+
+# Returns the name of the csv file written for a billing period
+def getBillsFilename(startTimestamp, endTimestamp):
     startTimeStr = getTimestampStr(startTimestamp)
     endTimeStr = getTimestampStr(endTimestamp)
+    return 'billing ' + startTimeStr + ' to ' + endTimeStr + '.csv'
+
 
-    filename = 'billing ' + startTimeStr + ' to ' + endTimeStr + '.csv'
-    with open(filename, 'w') as f:
-        for key, value in sorted(bills.items()):
-            f.write(str(key) + ',' + ",".join(str(x) for x in value) + '\n')
+# Gets all the txns in the time period starting with startTimestamp and
+# ending with endTimestamp, calculates how much every DID owner owes
+# from that period (based on type and number of txns written), and prints this
+# info to a csv file. The file is written to a temporary file first and then
+# renamed, so a reader never sees a partially written report.
+def outputBillsFile(startTimestamp, endTimestamp, bills, directory=None):
+    filename = getBillsFilename(startTimestamp, endTimestamp)
+    if directory is not None:
+        filename = os.path.join(directory, filename)
+
+    fd, tmpFilename = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or '.', prefix='.billing-',
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(billRows(bills))
+        # mkstemp only grants access to the owner
+        os.chmod(tmpFilename, 0o644)
+        os.replace(tmpFilename, filename)
+    except BaseException:
+        os.unlink(tmpFilename)
+        raise
 
     print('Billing by did written to \'' + filename + '\'.')
+    return filename
 
 
 # Looks at the Sovrin fiat fees spreadsheet (in csv format) and converts it
@@ -156,6 +222,13 @@ def getFiatFees(csvFile='fiatFees.csv'):
     with open(csvFile, 'r') as file:
         lines = file.readlines()
 
+    return parseFiatFees(lines)
+
+
+# Converts the lines of the fiat fees csv file into a dict of key: timestamp
+# the fees took effect, val: dict of key: txn type, val: fee
+def parseFiatFees(lines):
+    lines = list(lines)
     if len(lines) == 0:
         raise Exception('No fee information found')
 
@@ -191,9 +264,10 @@ def getFiatFees(csvFile='fiatFees.csv'):
 
 
 # Calculates the bill amount for each did in the time period, checking for
-# fee updates based on the Sovrin fees spreadsheet on Google Sheets
-# TODO: add way to check if txn was token-based or fiat-based
-def calculateBills(feesByTimePeriod, txns):
+# fee updates based on the Sovrin fees spreadsheet on Google Sheets.
+# txns is a dict of key: seqNo, val: txn. isTokenPaid, if given, is called with
+# the seqNo of every txn; txns whose fees were paid with tokens are not billed.
+def calculateBills(feesByTimePeriod, txns, isTokenPaid=None):
     # dict of all DIDs who owe money for the current period
     # in the form key: did, val: list of amounts owed in the following order:
     #     [total, nym, attrib, schema, cred_def, revog_reg, revoc_reg update]
@@ -227,7 +301,9 @@ def calculateBills(feesByTimePeriod, txns):
         # TODO: add support for revoc_reg when these are finalized in code
         return billList
 
-    for t in txns.values():
+    for seqNo, t in txns.items():
+        if isTokenPaid is not None and isTokenPaid(seqNo):
+            continue
         # populate bills dict
         if t.getSenderDid() not in bills:
             bills[t.getSenderDid()] = _getFeeForTxn(t, feesByTimePeriod)
@@ -255,7 +331,8 @@ async def run(args):
         return
 
     # all transactions in the specified range
-    txns = await loadTxnsLocally(args, startTimestamp, endTimestamp)
+    txns, tokenPaid = await loadTxnsLocally(args, startTimestamp,
+                                            endTimestamp)
 
     # the commented code below provides additional ledger statistics and can
     # be uncommented if desired
@@ -275,14 +352,16 @@ async def run(args):
     # printFeesInPeriod(txns, txnsByType, feesByTimePeriod,
     #                  startTimestamp, endTimestamp)
 
-    bills = calculateBills(feesByTimePeriod, txns)
-    outputBillsFile(startTimestamp, endTimestamp, bills)
+    bills = calculateBills(feesByTimePeriod, txns, tokenPaid.__contains__)
+    filename = outputBillsFile(startTimestamp, endTimestamp, bills)
 
     # Prints all schema keys
     # for t in txnsByType['101']:
     #    print('\n\n')
     #    t.printKeys()
 
+    return filename
+
 
 if __name__ == '__main__':
     args = parseArgs()
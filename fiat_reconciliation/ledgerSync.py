@@ -0,0 +1,126 @@
+import asyncio
+import time
+from fiatReconciler import getFiatFees, getLedgerTip
+from local_ledger import LocalLedger
+
+'''
+Keeps a long-lived LocalLedger connection in sync with the pool from a
+background task, so billing requests only ever read from the local store.
+
+Every sync also brings the payment index up to date and refreshes the fiat fee
+schedule, so billing jobs never have to download anything themselves.
+'''
+
+
+class LedgerSync():
+    '''
+    Periodically downloads new transactions into a LocalLedger.
+    interval: seconds to wait between the end of one sync and the next
+    '''
+
+    def __init__(self, databaseDir, poolname, walletname, key, did,
+                 interval=300):
+        self.ledger = LocalLedger(databaseDir, poolname, walletname, key, did)
+        self.interval = interval
+        self.feesByTimePeriod = None
+        # newest domain txn whose fee payment has been indexed as well
+        self.syncedSeqNo = None
+        self.lastSync = None
+        self.lastError = None
+        self._connected = False
+        self._ready = asyncio.Event()
+        # set while the last sync attempt has failed
+        self._failed = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        '''Starts the background sync task on the running event loop'''
+        self._task = asyncio.ensure_future(self._syncForever())
+
+    async def stop(self):
+        '''Stops syncing and closes the pool and wallet connections'''
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._disconnect()
+
+    async def waitUntilReady(self, timeout=None):
+        '''
+        Waits until the first sync (ledger and fees) has completed. Raises an
+        exception with the sync error as soon as a sync attempt fails before
+        that, or if it has not completed within timeout seconds.
+        '''
+        if self._ready.is_set():
+            return
+        waiters = [asyncio.ensure_future(self._ready.wait()),
+                   asyncio.ensure_future(self._failed.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        if self._ready.is_set():
+            return
+        if self._failed.is_set():
+            raise Exception('Ledger sync failed: ' + self.lastError)
+        raise Exception('Ledger has not been synced within {} seconds'
+                        .format(timeout))
+
+    async def syncOnce(self):
+        '''Brings the local ledger, payment index and fee schedule up to date'''
+        try:
+            if not self._connected:
+                await self.ledger.connect()
+                self._connected = True
+            await self.ledger.update()
+            # a fee payment is written to the payment ledger together with the
+            # txn it pays for, so once the payment ledger has been read after
+            # the domain ledger, every domain txn up to here is indexed
+            seqNo = self.ledger.getTxnCount()
+            await self.ledger.updatePaymentIndex()
+            self.syncedSeqNo = seqNo
+            # the fees spreadsheet is fetched with blocking urllib calls
+            loop = asyncio.get_event_loop()
+            self.feesByTimePeriod = await loop.run_in_executor(None,
+                                                               getFiatFees)
+            self.lastSync = time.time()
+            self.lastError = None
+            self._failed.clear()
+            self._ready.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print('Ledger sync failed:', repr(e))
+            self.lastError = str(e)
+            self._failed.set()
+            # reconnect from scratch on the next attempt
+            await self._disconnect()
+
+    def tip(self):
+        '''Returns (seqNo, timestamp) of the newest txn that can be billed'''
+        return getLedgerTip(self.ledger, self.syncedSeqNo)
+
+    def status(self):
+        seqNo, txnTime = self.tip()
+        return {
+            'ledgerTipSeqNo': seqNo,
+            'ledgerTipTime': txnTime,
+            'lastSync': self.lastSync,
+            'lastError': self.lastError
+        }
+
+    async def _syncForever(self):
+        while True:
+            await self.syncOnce()
+            await asyncio.sleep(self.interval)
+
+    async def _disconnect(self):
+        if not self._connected:
+            return
+        self._connected = False
+        try:
+            await self.ledger.disconnect()
+        except Exception as e:
+            print('Error while disconnecting from the ledger:', repr(e))
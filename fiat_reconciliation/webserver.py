@@ -1,30 +1,70 @@
 # Author: Ryan West ryanwest6@gmail.com
-from fiatReconciler import run
+from fiatReconciler import billFromLocalLedger, billRows, getTimestamp, \
+    outputBillsFile
+from billingJobs import JobQueue, DONE
+from ledgerSync import LedgerSync
 from aiohttp import web
+from functools import partial
 import sys
 import asyncio
-import os.path
 path =  '/home/ryanwest6/steward-tools/fiat_reconciliation/'
 sys.path.append(path)
 sys.path.append('/home/ryanwest6/steward-tools/local_ledger')
 
-gotResponse = True
-
-# Sends a request to the server which runs fiatReconciler.py on a timerange.
-
-
+# Billing jobs only read from the shared Local_Ledger, which is kept up to
+# date by a single background sync task, so several can run side by side.
+billingWorkers = 2
+# Seconds between the end of one ledger sync and the start of the next
+syncInterval = 300
+# Seconds a billing job waits for the first ledger sync before it fails
+syncWaitTimeout = 600
+# Directory to also save every finished billing csv in, or None to only keep
+# reports in memory
+billingOutputDir = None
+# Number of csv lines sent per chunk when streaming a report
+csvChunkRows = 500
+
+
+# This contains all arguments needed to connect to the ledger
+class argsContainer():
+    pool_name = 'mainnet'
+    wallet_name = 'junk'
+    wallet_key = 'junk'
+    signing_did = 'PLppMr8ttu37FnE5B4wRMu'
+    database_dir = path + 'ledger_copy.db'
+
+
+# Bills a timerange from the local ledger and returns the bills together with
+# the ledger tip they were computed against. Called by the job queue workers,
+# never directly by a request handler.
+async def runBilling(app, startdate, enddate):
+    print('Dates:', startdate, enddate)
+    startTimestamp = getTimestamp(startdate)
+    endTimestamp = getTimestamp(enddate)
+
+    sync = app['ledger']
+    await sync.waitUntilReady(syncWaitTimeout)
+    tipSeqNo, tipTime = sync.tip()
+    # reading rocksdb is blocking, so keep it off the event loop
+    loop = asyncio.get_event_loop()
+    bills = await loop.run_in_executor(
+        None, billFromLocalLedger, sync.ledger, sync.feesByTimePeriod,
+        startTimestamp, endTimestamp, tipSeqNo)
+    if billingOutputDir is not None:
+        await loop.run_in_executor(None, outputBillsFile, startTimestamp,
+                                   endTimestamp, bills, billingOutputDir)
+    return bills, {'seqNo': tipSeqNo, 'txnTime': tipTime}
+
+
+# Enqueues a billing job for the posted timerange and returns its id.
 async def postHandle(request):
-    # This acts as a lock since only one thread can access Local_Ledger at a
-    # time. Prevents more than one request at once.
-    global gotResponse
-    if not gotResponse:
-        return web.Response(text='Error: Not done processing last request. Please wait.')  # noqa
-
     if not request.body_exists:
         return web.Response(text='Error receiving start/end dates')
     # Parse data
     requestData = await request.read()
     parsedData = requestData.decode('ascii').split('&')
+    startdate = None
+    enddate = None
     for d in parsedData:
         if d.startswith('startdate='):
             startdate = d[len('startdate='):]
@@ -34,58 +74,48 @@ async def postHandle(request):
     if startdate is None or enddate is None:
         return web.Response(text='Error receiving start/end dates')
 
-    print('Dates:', startdate, enddate)
+    try:
+        job = request.app['jobs'].submit(startdate, enddate)
+    except ValueError:
+        return web.Response(text='Error: Wrong date formatting')
 
-    # This contains all arguments needed to run fiatReconciler.py
-    class argsContainer():
-        pool_name = 'mainnet'
-        wallet_name = 'junk'
-        wallet_key = 'junk'
-        signing_did = 'PLppMr8ttu37FnE5B4wRMu'
-        start_date = None
-        end_date = None
-        database_dir = path + 'ledger_copy.db'
+    return web.json_response(job.asDict())
 
-    args = argsContainer()
-    args.start_date = startdate
-    args.end_date = enddate
 
-    # BUG: stalls when accidental large date value written (eg year 20190)
-    # Should not matter unless post data is manually sent with this error
-    # Runs the script and displays any errors
-    try:
-        gotResponse = False
-        await run(args)  # This actually calls the billing function
-    except ValueError as e:
-        print(e)
-        gotResponse = True
-        return web.Response(text='Error: Wrong date formatting')
-    except Exception as e:
-        print(e)
-        print('unknown error')
-        # this program crashes itself if a new error comes up. It is 
-        # restarted with a cronjob.
-        exit(-1)
-        gotResponse = True
-        return web.Response(text='Error: ' + str(e))
-    outputFilename = 'billing ' + startdate.replace('/', '-') + ' to ' + \
-        enddate.replace('/', '-') + '.csv'
+# Reports the status of a billing job
+async def jobStatusHandle(request):
+    job = request.app['jobs'].getJob(request.match_info['id'])
+    if job is None:
+        raise web.HTTPNotFound(text='Error: Unknown job')
+    return web.json_response(job.asDict())
 
-    try:
-        # attempt to send the output file contents to the client
-        text = None
-        with open(outputFilename) as f:
-            text = f.read()
-            if text is None:
-                gotResponse = True
-                return web.Response(text='Error: ' + str(rv))
-    except FileNotFoundError:
-        gotResponse = True
-        return web.Response(text='Error: ' + str(rv))
-
-    # if we got here, everything was successful
-    gotResponse = True
-    return web.Response(text=text, content_type='text/html')
+
+# Streams the csv of a finished billing job with chunked transfer encoding
+async def jobCsvHandle(request):
+    job = request.app['jobs'].getJob(request.match_info['id'])
+    if job is None:
+        raise web.HTTPNotFound(text='Error: Unknown job')
+    if job.status != DONE:
+        raise web.HTTPConflict(text='Error: Job is ' + job.status)
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/csv'})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    chunk = []
+    for row in billRows(job.bills):
+        chunk.append(row)
+        if len(chunk) >= csvChunkRows:
+            await response.write(''.join(chunk).encode())
+            chunk = []
+    if chunk:
+        await response.write(''.join(chunk).encode())
+    await response.write_eof()
+    return response
+
+
+# Reports how far the local ledger copy has been synced
+async def ledgerStatusHandle(request):
+    return web.json_response(request.app['ledger'].status())
 
 
 # Send main webpage to user that allows sending post requests
@@ -96,8 +126,28 @@ async def getHandle(request):
     return web.Response(text=text, content_type='text/html')
 
 
+async def startBackground(app):
+    args = argsContainer()
+    app['ledger'] = LedgerSync(args.database_dir, args.pool_name,
+                               args.wallet_name, args.wallet_key,
+                               args.signing_did, interval=syncInterval)
+    await app['ledger'].start()
+    app['jobs'] = JobQueue(partial(runBilling, app), workers=billingWorkers)
+    await app['jobs'].start()
+
+
+async def stopBackground(app):
+    await app['jobs'].stop()
+    await app['ledger'].stop()
+
+
 app = web.Application()
+app.on_startup.append(startBackground)
+app.on_cleanup.append(stopBackground)
 app.add_routes([web.get('/', getHandle),
-                web.post('/', postHandle)])
+                web.post('/', postHandle),
+                web.get('/ledger', ledgerStatusHandle),
+                web.get('/jobs/{id}', jobStatusHandle),
+                web.get('/jobs/{id}/csv', jobCsvHandle)])
 
 web.run_app(app)
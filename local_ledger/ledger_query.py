@@ -140,6 +140,41 @@ def _getTxnByTimestamp(ledger, timestamp, contiguous=True):
         return None, None
 
 
+def _getStartSeqNo(ledger, startTime):
+    '''Sequence number of the first txn at or after startTime'''
+    startSeqNo, _ = _getTxnByTimestamp(ledger, startTime)
+    return startSeqNo
+
+
+def _getEndSeqNo(ledger, endTime):
+    '''Sequence number of the last txn at or before endTime'''
+    endSeqNo, txn = _getTxnByTimestamp(ledger, endTime)
+    if endSeqNo is None:
+        return None
+    # since getTxnByTimestamp returns the NEXT transaction at or after the
+    # given timestamp, decrement ending sequence number if it is after the
+    # ending time
+    if 'txnTime' in txn['txnMetadata'] and \
+            txn['txnMetadata']['txnTime'] > endTime:
+        endSeqNo -= 1
+    return endSeqNo
+
+
+def getSeqNoRange(ledger, startTime, endTime):
+    '''
+    Returns (startSeqNo, endSeqNo) of the transactions within a range of
+    time, both inclusive, without reading the transactions in between.
+    Returns (None, None) if the ledger has no transactions.
+    '''
+    startSeqNo = _getStartSeqNo(ledger, startTime)
+    if startSeqNo is None:
+        return None, None
+    endSeqNo = _getEndSeqNo(ledger, endTime)
+    if endSeqNo is None:
+        return None, None
+    return startSeqNo, endSeqNo
+
+
 def getTxnRange(ledger, startTime=None, endTime=None,
                 startSeqNo=None, endSeqNo=None):
     '''
@@ -148,20 +183,14 @@ def getTxnRange(ledger, startTime=None, endTime=None,
     Both start and end parameters are inclusive.
     '''
     if startSeqNo is None:
-        startSeqNo, _ = _getTxnByTimestamp(ledger, startTime)
+        startSeqNo = _getStartSeqNo(ledger, startTime)
         # Returns none if ledger had 0 txns
         if startSeqNo is None:
             return None
     if endSeqNo is None:
-        endSeqNo, txn = _getTxnByTimestamp(ledger, endTime)
+        endSeqNo = _getEndSeqNo(ledger, endTime)
         if endSeqNo is None:
             return None
-        # since getTxnByTimestamp returns the NEXT transaction at or after the
-        # given timestamp, decrement ending sequence number if it is after the
-        # ending time
-        if 'txnTime' in txn['txnMetadata'] and \
-                txn['txnMetadata']['txnTime'] > endTime:
-            endSeqNo -= 1
     if startSeqNo < 1 or endSeqNo < startSeqNo:
         if ((isinstance(ledger, LocalLedger) and
                 endSeqNo > getTxnCount(ledger)) or isinstance(ledger, dict) and
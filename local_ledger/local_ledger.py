@@ -5,6 +5,13 @@ import os
 from indy import ledger, pool, wallet
 from transaction import Transaction
 
+# sovtoken payment ledger, and the FEES txn written to it whenever the fees of
+# a txn on another ledger are paid with tokens. Its 'ref' field points to the
+# paid txn as "<ledger id>:<seqNo>".
+PAYMENT_LEDGER = '1001'
+FEES_TXN = '10001'
+DOMAIN_LEDGER_ID = '1'
+
 
 class TxnDoesNotExistException(Exception):
     pass
@@ -27,18 +34,25 @@ class LocalLedger():
     need to be implemented in indy-sdk.
     '''
 
-    def __init__(self, databaseDir, poolname, walletname, key, did):
-        '''Setup for inital use'''
+    def __init__(self, databaseDir, poolname, walletname, key, did,
+                 readOnly=False):
+        '''Setup for inital use. With readOnly, the database must already
+        exist and can be opened by several processes at once; update() is
+        then unavailable.'''
         self.poolname = poolname
         self.walletname = walletname
         self.key = key
         self.did = did
+        self.readOnly = readOnly
         if not os.path.isdir(databaseDir):
+            if readOnly:
+                raise Exception('Local ledger database not found')
             print('Local ledger database not found; creating a new one')
         # _db should not be modified directly, as len(_db) may no longer
         # be accurate
         self._db = rocksdb.DB(
-            databaseDir, rocksdb.Options(create_if_missing=True))
+            databaseDir, rocksdb.Options(create_if_missing=not readOnly),
+            read_only=readOnly)
         self.pool_handle = None
         self.wallet_handle = None
 
@@ -73,6 +87,14 @@ class LocalLedger():
                           seq_no):
         '''Attempts to download the transaction with given sequence number'''
 
+        key, value = await self._fetchTxn(pool_handle, submitter_did,
+                                          which_ledger, seq_no)
+        self._db.put(self._intToBytes(key), json.dumps(value).encode())
+
+    async def _fetchTxn(self, pool_handle, submitter_did, which_ledger,
+                        seq_no):
+        '''Requests a transaction from the pool and returns (seqNo, data)'''
+
         # build get_txn request
         getTxnJson = await ledger.build_get_txn_request(submitter_did,
                                                         which_ledger, seq_no)
@@ -98,7 +120,7 @@ class LocalLedger():
             print('\n', json.dumps(json.loads(response), indent=4))
             raise InvalidLedgerResponseException()
 
-        self._db.put(self._intToBytes(key), json.dumps(value).encode())
+        return key, value
 
     async def update(self, limit=None):
         ''' Downloads new transactions to sync local db with the remote.
@@ -106,6 +128,8 @@ class LocalLedger():
 
         if limit is not None and limit < 1:
             raise Exception('Limit must be at least 1')
+        if self.readOnly:
+            raise Exception('Cannot update a read-only local ledger')
 
         # gets the last sequence number stored locally and updates from there
         curTxn = self.getTxnCount() + 1
@@ -134,6 +158,88 @@ class LocalLedger():
         else:
             print('Local ledger has reached limit of', str(limit), 'txns.')
 
+    async def updatePaymentIndex(self, limit=None):
+        ''' Reads new payment ledger transactions and records which domain
+            transactions had their fees paid with tokens. Only this index is
+            stored, not the payment transactions themselves.
+            limit: highest payment txn sequence number to read before
+            stopping'''
+
+        if limit is not None and limit < 1:
+            raise Exception('Limit must be at least 1')
+        if self.readOnly:
+            raise Exception('Cannot update a read-only local ledger')
+
+        if not await self.hasPaymentLedger():
+            print('Payment ledger not available; token-paid txns '
+                  'cannot be told apart from fiat-paid ones.')
+            return
+
+        curTxn = self.getPaymentTxnCount() + 1
+        print('Last payment transaction sequence number:', str(curTxn - 1))
+        while limit is None or limit >= curTxn:
+            try:
+                _, value = await self._fetchTxn(self.pool_handle, self.did,
+                                                PAYMENT_LEDGER, curTxn)
+            except TxnDoesNotExistException:
+                break
+
+            self._indexFeeTxn(value)
+            self._db.put(b'lastPaymentTxnDownloaded', int.to_bytes(
+                curTxn, 10, byteorder='big'))
+            curTxn += 1
+
+        print('Payment index is up to date.')
+
+    async def hasPaymentLedger(self):
+        '''True if the pool has a payment ledger. Pools without the token
+           plugin reject (REQNACK) requests for it instead of replying.'''
+
+        getTxnJson = await ledger.build_get_txn_request(self.did,
+                                                        PAYMENT_LEDGER, 1)
+        response = await ledger.submit_request(self.pool_handle, getTxnJson)
+        return json.loads(response).get('op') == 'REPLY'
+
+    def _indexFeeTxn(self, data):
+        '''Records the domain txn paid for by a FEES txn, if data is one'''
+
+        try:
+            if data['txn']['type'] != FEES_TXN:
+                return
+            fees = data['txn']['data'].get('fees', 0)
+            ledgerId, seqNo = data['txn']['data']['ref'].split(':')
+        except (KeyError, AttributeError, ValueError):
+            return
+        if ledgerId != DOMAIN_LEDGER_ID:
+            return
+        self._db.put(self._feeKey(int(seqNo)), json.dumps(fees).encode())
+
+    def _feeKey(self, seqNo):
+        return b'feePaid:' + int.to_bytes(seqNo, 10, byteorder='big')
+
+    def getPaymentTxnCount(self):
+        '''Gets the number of payment ledger txns read into the index'''
+
+        try:
+            return int.from_bytes(self._db.get(b'lastPaymentTxnDownloaded'),
+                                  byteorder='big')
+        except Exception:
+            return 0
+
+    def getTokenFee(self, seqNo):
+        '''Returns the fee paid in tokens for the domain txn with the given
+           sequence number, or None if it was not paid with tokens'''
+
+        fee = self._db.get(self._feeKey(seqNo))
+        if fee is None:
+            return None
+        return json.loads(fee.decode('ascii'))
+
+    def isTokenPaid(self, seqNo):
+        '''True if the fees of the domain txn were paid with tokens'''
+
+        return self._db.get(self._feeKey(seqNo)) is not None
+
     def _intToBytes(self, x):
         return x.to_bytes((x.bit_length() + 7) // 8, 'big')
 
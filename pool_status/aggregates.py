@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Aggregates of one field across all nodes
+
+A field is read for every node straight from the per-node FieldIndex, giving
+a column of values that the operators below work on as a whole.
+"""
+
+import json
+import statistics
+from collections import Counter
+
+# Paths of the show shortcuts that name a single value. '{node}' is replaced
+# by the name of each node.
+SHORTCUTS = {
+    'transCount': 'Node_info/Metrics/transaction-count/ledger',
+    'version': 'Software/indy-node',
+    'primary': 'Node_info/Replicas_status/{node}:0/Primary',
+    'reachable': 'Pool_info/Reachable_nodes_count',
+}
+
+
+def column(indexes: dict, field: str, nodes=None) -> dict:
+    """
+    Returns a dictionary of node name to the value of 'field' for every node
+    in 'nodes' (default: all indexed nodes) that has it
+    """
+    path = SHORTCUTS.get(field, field)
+    if nodes is None:
+        nodes = indexes.keys()
+    values = {}
+    for node in nodes:
+        index = indexes.get(node)
+        if index is None:
+            continue
+        node_path = path.format(node=node) if '{node}' in path else path
+        if node_path in index:
+            values[node] = index.get(node_path)
+    return values
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _key(value):
+    """
+    Hashable stand-in for a value, so lists and dictionaries can be grouped
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def stats(values: dict) -> dict:
+    """
+    Count, min, max, median and mean of the numeric values of a column
+    """
+    numbers = [value for value in values.values() if _is_number(value)]
+    if not numbers:
+        return {'count': 0}
+    low = min(numbers)
+    high = max(numbers)
+    return {
+        'count': len(numbers),
+        'min': low,
+        'min_nodes': sorted(node for node, value in values.items() if value == low),
+        'max': high,
+        'max_nodes': sorted(node for node, value in values.items() if value == high),
+        'median': statistics.median(numbers),
+        'mean': statistics.mean(numbers),
+    }
+
+
+def group_by(values: dict) -> dict:
+    """
+    Groups the nodes of a column by value, largest group first
+    """
+    groups = {}
+    for node, value in values.items():
+        groups.setdefault(_key(value), []).append(node)
+    ordered = sorted(groups.items(), key=lambda group: (-len(group[1]), str(group[0])))
+    return {value: sorted(nodes) for value, nodes in ordered}
+
+
+def deviants(values: dict, tolerance: float = None) -> (object, dict):
+    """
+    Finds the majority value of a column and the nodes that deviate from it
+
+    With a tolerance, numeric values within 'tolerance' of the majority value
+    do not count as deviating.
+
+    Returns (majority value, dictionary of deviating node to its value)
+    """
+    if not values:
+        return None, {}
+    counts = Counter(_key(value) for value in values.values())
+    majority = counts.most_common(1)[0][0]
+    deviating = {}
+    for node, value in values.items():
+        key = _key(value)
+        if key == majority:
+            continue
+        if tolerance is not None and _is_number(value) and _is_number(majority) \
+                and abs(value - majority) <= tolerance:
+            continue
+        deviating[node] = value
+    return majority, dict(sorted(deviating.items()))
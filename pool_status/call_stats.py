@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Call timings for the libindy helper layer
+
+Every instrumented call adds its duration to a fixed bucket histogram kept in
+memory under the call's name, and failures are counted by error. Recording a
+call is a handful of additions, so the helpers stay instrumented all the time.
+"""
+
+import functools
+import json
+import logging
+import time
+
+log = logging.getLogger('root')
+
+# Upper bounds in seconds of the histogram buckets. Pool requests are slow,
+# so the buckets reach well beyond libindy's default timeout.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class CallStat(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # one more bucket than bounds: the last one catches everything slower
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.errors = {}
+
+    def record(self, seconds: float, error: str = None):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-quantile, capped at the
+        largest seen duration
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets[:-1]):
+            seen += bucket
+            if seen >= rank:
+                return min(BUCKETS[i], self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': dict(self.errors),
+            'total_seconds': round(self.total, 6),
+            'mean_seconds': round(self.total / self.count, 6) if self.count else 0.0,
+            'max_seconds': round(self.max, 6),
+            'p50_seconds': self.quantile(0.5),
+            'p95_seconds': self.quantile(0.95),
+            'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+class CallStats(object):
+    """
+    Histograms and error counts of every instrumented call, by name
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    def record(self, name: str, seconds: float, error: str = None):
+        stat = self.calls.get(name)
+        if stat is None:
+            stat = self.calls[name] = CallStat()
+        stat.record(seconds, error)
+
+    def reset(self):
+        self.calls = {}
+
+    def as_dict(self) -> dict:
+        return {name: stat.as_dict() for name, stat in sorted(self.calls.items())}
+
+    def dump(self) -> str:
+        """
+        Returns a table of the recorded calls, slowest in total first
+        """
+        lines = ['{:<28}{:>7}{:>8}{:>10}{:>10}{:>10}{:>10}{:>11}'.format(
+            'call', 'count', 'errors', 'mean', 'p50', 'p95', 'max', 'total')]
+        ordered = sorted(self.calls.items(), key=lambda item: -item[1].total)
+        for name, stat in ordered:
+            lines.append('{:<28}{:>7}{:>8}{:>9.3f}s{:>9.3f}s{:>9.3f}s{:>9.3f}s{:>10.3f}s'.format(
+                name, stat.count, sum(stat.errors.values()),
+                stat.total / stat.count if stat.count else 0.0,
+                stat.quantile(0.5), stat.quantile(0.95), stat.max, stat.total))
+            for error, count in sorted(stat.errors.items()):
+                lines.append('    {}: {}'.format(error, count))
+        return '\n'.join(lines)
+
+    def log_summary(self):
+        """
+        Logs every recorded call as a single JSON line
+        """
+        log.info(json.dumps({'call_stats': self.as_dict()}, sort_keys=True))
+
+
+stats = CallStats()
+
+
+def error_name(e: BaseException) -> str:
+    # libindy errors are only told apart by their code
+    code = getattr(e, 'error_code', None)
+    if code is not None:
+        return '{}({})'.format(type(e).__name__, code)
+    return type(e).__name__
+
+
+def timed(name: str):
+    """
+    Decorator recording the duration of every call of a coroutine function
+    under 'name', and counting the calls that raise
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = None
+            try:
+                return await function(*args, **kwargs)
+            except BaseException as e:
+                error = error_name(e)
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                stats.record(name, seconds, error)
+                log.debug(json.dumps({'call': name, 'seconds': round(seconds, 6), 'error': error}))
+        return wrapper
+    return decorator
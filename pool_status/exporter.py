@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Prometheus/OpenMetrics exporter for pool status
+
+The pool is queried for validator-info in the background every --interval
+seconds and the metrics are rendered once per refresh. Scrapes are answered
+from that cached text, so they never trigger a request to the pool and take
+the same time whatever the size of the pool.
+"""
+
+import argparse
+import asyncio
+import getpass
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from helper_functions import *
+from call_stats import BUCKETS, stats as call_stats
+from metrics import METRIC_PATHS, get_path, node_metrics
+from validator_info import parse_validator_info, WALLET_KEY_ENV
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**pairs) -> str:
+    return '{' + ','.join('{}="{}"'.format(key, escape_label(value)) for key, value in pairs.items()) + '}'
+
+
+def numeric_leaves(tree, prefix=''):
+    """
+    Yields (path, value) for every number in 'tree', paths joined with '/'
+    """
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            yield from numeric_leaves(value, '{}{}/'.format(prefix, key))
+    elif isinstance(tree, (int, float)) and not isinstance(tree, bool):
+        yield prefix[:-1], tree
+
+
+class MetricFamily(object):
+    def __init__(self, name: str, help_text: str, metric_type: str = 'gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.samples = []
+
+    def add(self, value, suffix='', **pairs):
+        self.samples.append((suffix, labels(**pairs) if pairs else '', value))
+
+    def render(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.help_text),
+                 '# TYPE {} {}'.format(self.name, self.metric_type)]
+        lines.extend('{}{}{} {}'.format(self.name, suffix, label_text, value) for suffix, label_text, value in self.samples)
+        return '\n'.join(lines) + '\n'
+
+
+def render_metrics(replies: dict, info: dict, refresh_seconds: float, refreshed_at: float, errors: int) -> str:
+    """
+    Renders the exposition text for one validator-info snapshot. 'replies'
+    holds the raw reply of every node (to tell which nodes answered) and
+    'info' the parsed validator-info data of the nodes that did.
+    """
+    up = MetricFamily('indy_node_up', 'Whether the node answered the last validator-info request')
+    trans_count = MetricFamily('indy_node_transaction_count', 'Transactions on each ledger of the node')
+    reachable = MetricFamily('indy_pool_reachable_nodes', 'Nodes the node can reach')
+    unreachable = MetricFamily('indy_pool_unreachable_nodes', 'Nodes the node cannot reach')
+    total = MetricFamily('indy_pool_total_nodes', 'Nodes in the pool according to the node')
+    view_no = MetricFamily('indy_node_view_no', 'Current view number of the node')
+    view_change = MetricFamily('indy_node_view_change_in_progress', 'Whether the node is in a view change')
+    primary = MetricFamily('indy_node_primary_info', 'Primary of the master instance as seen by the node')
+    software = MetricFamily('indy_node_software_info', 'Software versions installed on the node')
+    node_info = MetricFamily('indy_node_metrics', 'Numeric values under Node_info/Metrics')
+
+    for node in sorted(replies):
+        up.add(1 if node in info else 0, node=node)
+    for node, data in sorted(info.items()):
+        metrics = node_metrics(node, data)
+        for name, value in sorted(metrics.items()):
+            if name.startswith('transaction-count.'):
+                trans_count.add(value, node=node, ledger=name[len('transaction-count.'):])
+        for family, name in ((reachable, 'reachable-nodes'), (unreachable, 'unreachable-nodes'),
+                             (total, 'total-nodes'), (view_no, 'view-no'),
+                             (view_change, 'view-change-in-progress')):
+            if name in metrics:
+                family.add(metrics[name], node=node)
+        if 'primary' in metrics:
+            primary.add(1, node=node, primary=metrics['primary'])
+        software.add(1, node=node, indy_node=metrics.get('version.indy-node', ''),
+                     sovrin=metrics.get('version.sovrin', ''))
+        for path, value in numeric_leaves(get_path(data, ['Node_info', 'Metrics'])):
+            if not path.startswith('transaction-count/'):
+                node_info.add(value, node=node, name=path)
+
+    refresh = MetricFamily('indy_exporter_refresh_duration_seconds', 'Time the last validator-info refresh took')
+    refresh.add(refresh_seconds)
+    last = MetricFamily('indy_exporter_last_refresh_timestamp_seconds', 'When the served snapshot was taken')
+    last.add(refreshed_at)
+    failures = MetricFamily('indy_exporter_refresh_errors_total', 'Failed validator-info refreshes', 'counter')
+    failures.add(errors)
+
+    calls = MetricFamily('indy_helper_call_duration_seconds', 'Duration of the calls to the pool and wallet', 'histogram')
+    call_errors = MetricFamily('indy_helper_call_errors_total', 'Failed calls to the pool and wallet', 'counter')
+    for name, stat in sorted(call_stats.calls.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stat.buckets):
+            cumulative += count
+            calls.add(cumulative, '_bucket', call=name, le=bound)
+        calls.add(stat.count, '_bucket', call=name, le='+Inf')
+        calls.add(stat.total, '_sum', call=name)
+        calls.add(stat.count, '_count', call=name)
+        for error, count in sorted(stat.errors.items()):
+            call_errors.add(count, call=name, error=error)
+
+    families = [up, trans_count, reachable, unreachable, total, view_no, view_change,
+                primary, software, node_info, refresh, last, failures, calls, call_errors]
+    return ''.join(family.render() for family in families)
+
+
+class Exporter(object):
+    """
+    Holds the latest rendered snapshot and refreshes it from a PoolSession
+    """
+
+    def __init__(self, session, interval: int):
+        self.session = session
+        self.interval = interval
+        self.errors = 0
+        # replaced as a whole on every refresh, so the HTTP threads never see
+        # a half written snapshot
+        self.body = b''
+
+    async def refresh(self):
+        started = time.time()
+        try:
+            replies = await self.session.get_validator_info()
+            info = parse_validator_info(replies, METRIC_PATHS)
+        except Exception as e:
+            self.errors += 1
+            log.error("Refreshing validator-info failed: {}".format(e))
+            return
+        self.body = render_metrics(replies, info, time.time() - started, started, self.errors).encode()
+
+    async def refresh_forever(self):
+        while True:
+            started = time.time()
+            await self.refresh()
+            await asyncio.sleep(max(0, self.interval - (time.time() - started)))
+
+    def serve(self, port: int):
+        """
+        Starts the HTTP server on a background thread
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.body
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        server = ThreadingHTTPServer(('', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def parse_inputs():
+    parser = argparse.ArgumentParser(
+        description='Serve validator-info of a pool as Prometheus metrics on /metrics. The wallet key is read from the {} environment variable if it is set.'.format(WALLET_KEY_ENV))
+    parser.add_argument('pool', help='The name of the pool to connect to')
+    parser.add_argument('wallet', help='The name of the wallet to use')
+    parser.add_argument('did', help='DID of steward')
+    parser.add_argument('--genesisFile', help='Needed if the pool has not been previously initialized.')
+    parser.add_argument('--didSeed', action='store_true', help='Prompt for seed. Use if keys are not yet in your wallet')
+    parser.add_argument('--port', type=int, default=9500, help='Port to serve metrics on (default: 9500)')
+    parser.add_argument('--interval', type=int, default=60, help='Seconds between two validator-info refreshes (default: 60)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_inputs()
+    # helper_functions sends stderr to the log, so log to the real stderr
+    console_handler = logging.StreamHandler(sys.__stderr__)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s'))
+    log.addHandler(console_handler)
+    didSeed = getpass.getpass("DID seed: ") if args.didSeed else None
+    walletKey = os.environ.get(WALLET_KEY_ENV)
+    if walletKey is None:
+        walletKey = getpass.getpass("Wallet key: ")
+    session = PoolSession(args.pool, args.wallet, walletKey, args.did, args.genesisFile, didSeed)
+    exporter = Exporter(session, args.interval)
+    looper = asyncio.get_event_loop()
+    looper.run_until_complete(session.open())
+    server = exporter.serve(args.port)
+    try:
+        looper.run_until_complete(exporter.refresh_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        looper.run_until_complete(session.close())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Flattened path index of a node's validator-info tree
+
+The tree is walked once when the info is loaded. Afterwards looking up a
+slash separated path or listing the children of a path only touches the
+matching entries.
+"""
+
+from bisect import bisect_left
+
+SEPARATOR = '/'
+
+
+def join_path(parent: str, key) -> str:
+    return '{}{}{}'.format(parent, SEPARATOR, key) if parent else str(key)
+
+
+class FieldIndex(object):
+    """
+    Maps every path of a tree (inner branches and leaves alike, the root being
+    '') to the value found there. Values are the tree's own objects, nothing
+    is copied.
+    """
+
+    def __init__(self, tree):
+        self.values = {}
+        self.children = {}
+        stack = [('', tree)]
+        while stack:
+            path, value = stack.pop()
+            self.values[path] = value
+            if isinstance(value, dict):
+                self.children[path] = sorted(str(key) for key in value)
+                for key, child in value.items():
+                    stack.append((join_path(path, key), child))
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.values
+
+    def get(self, path: str, default=None):
+        return self.values.get(path, default)
+
+    def leaves(self):
+        """
+        Yields (path, value) for every leaf, i.e. every value that is not a
+        dictionary
+        """
+        for path, value in self.values.items():
+            if not isinstance(value, dict):
+                yield path, value
+
+    def children_of(self, path: str, prefix: str = '') -> list:
+        """
+        Keys directly below 'path' that start with 'prefix'
+        """
+        keys = self.children.get(path, [])
+        return _with_prefix(keys, prefix)
+
+
+def _with_prefix(sorted_items: list, prefix: str) -> list:
+    matches = []
+    for i in range(bisect_left(sorted_items, prefix), len(sorted_items)):
+        if not sorted_items[i].startswith(prefix):
+            break
+        matches.append(sorted_items[i])
+    return matches
+
+
+def build_indexes(info: dict) -> dict:
+    """
+    Builds the index of every node in 'info'. Nodes without data (for example
+    'timeout' entries of saved files) are left out.
+    """
+    return {node: FieldIndex(data) for node, data in info.items() if isinstance(data, dict)}
@@ -10,9 +10,15 @@ import sys
 from indy import did, ledger, pool, wallet
 import logging
 import time
+from call_stats import error_name, stats, timed
 
 ## - Functions - ##
 
+# Queries of single nodes after which stream_validator_info learns the node
+# names again from the pool, so that nodes added to or removed from the pool
+# are noticed by sessions that stay open
+NODE_REFRESH_QUERIES = 10
+
 log = logging.getLogger('root')
 log.setLevel(logging.INFO)
 
@@ -36,6 +42,7 @@ class LoggerWriter(object):
 sys.stderr = LoggerWriter(log.warning)
 
 
+@timed('create_wallet')
 async def create_wallet(name: str, key: str, path: str = None):
     """
     Create a new wallet
@@ -64,6 +71,7 @@ async def create_wallet(name: str, key: str, path: str = None):
             raise
 
 
+@timed('get_attrib')
 async def get_attrib(pool_handle: int, from_did: str, attrib: str) -> dict:
     """
     Request an attrib from the pool
@@ -86,6 +94,7 @@ async def get_attrib(pool_handle: int, from_did: str, attrib: str) -> dict:
     log.debug("Response received, returning results")
     return json.loads(res)
 
+@timed('get_did_from_wallet')
 async def get_did_from_wallet(wallet_handle: int, lookup_did: str) -> str:
     """
     Request a DID from a wallet
@@ -102,6 +111,7 @@ async def get_did_from_wallet(wallet_handle: int, lookup_did: str) -> str:
             return did_e
     return None
 
+@timed('create_pool_config')
 async def create_pool_config(name: str, genesis_path: str) -> None:
     """
     Creates a new pool config named 'name' using genesis file at 'genesis_path'
@@ -115,6 +125,7 @@ async def create_pool_config(name: str, genesis_path: str) -> None:
         json.dumps(pool_config)
     )
 
+@timed('open_pool')
 async def open_pool(name: str, genesis_path: str = None) -> int:
     """
     Opens a pool configuration identified by 'name', If it doesn't exist, then
@@ -144,6 +155,7 @@ async def open_pool(name: str, genesis_path: str = None) -> int:
     log.debug("Successfully connected to pool: '{}' with handle: {}".format(name, handle))
     return handle
 
+@timed('open_wallet')
 async def open_wallet(name: str, key: str, path: str = None):
     """
     Opens a wallet identified by 'name', using key 'key'. If the wallet doesn't
@@ -192,6 +204,7 @@ async def open_wallet(name: str, key: str, path: str = None):
     log.debug("Successfully opened wallet: '{}' with handle: {}".format(name, handle))
     return handle
 
+@timed('store_did')
 async def store_did(wallet_handle: int, seed: str) -> tuple:
     """
     Stores a DID to the wallet_handle 'wallet_handle', using the seed 'seed'
@@ -208,6 +221,7 @@ async def store_did(wallet_handle: int, seed: str) -> tuple:
     log.debug("Successfully generated and stored DID: '{}' and VerKey: '{}' from seed to wallet handle: {}".format(n_did, n_verkey, wallet_handle))
     return (n_did, n_verkey)
 
+@timed('set_attrib')
 async def set_attrib(pool_handle: int, wallet_handle: int, src_did: str, attrib: str) -> dict:
     """
     Set the attrib 'attrib' to the did 'src_did' found in 'wallet_handle' to
@@ -232,3 +246,182 @@ async def set_attrib(pool_handle: int, wallet_handle: int, src_did: str, attrib:
     )
     log.debug("Response received, returning results")
     return json.loads(res)
+
+class PoolSession(object):
+    """
+    Keeps a pool handle, a wallet handle and a checked signing DID open across
+    calls, so repeated requests (reload, daemon polling, exporters) do not pay
+    for reconnecting to the pool and reopening the wallet every time.
+
+    Use as 'async with PoolSession(...) as session:' or call open() and
+    close() explicitly. open() is idempotent.
+    """
+
+    def __init__(self, pool_name: str, wallet_name: str, wallet_key: str,
+                 did: str, genesis_path: str = None, did_seed: str = None,
+                 wallet_path: str = None):
+        self.pool_name = pool_name
+        self.wallet_name = wallet_name
+        self.wallet_key = wallet_key
+        self.did = did
+        self.genesis_path = genesis_path
+        self.did_seed = did_seed
+        self.wallet_path = wallet_path
+        self.pool_handle = None
+        self.wallet_handle = None
+        self.did_checked = False
+        # node names learned from the last full validator-info request, and
+        # the number of queries of single nodes made with them since
+        self.node_names = []
+        self.node_queries = 0
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """
+        Opens the pool and wallet, and makes sure the signing DID is in the
+        wallet (storing it from the seed if one was given)
+        """
+        if self.pool_handle is None:
+            self.pool_handle = await open_pool(self.pool_name, self.genesis_path)
+        if self.wallet_handle is None:
+            self.wallet_handle = await open_wallet(self.wallet_name, self.wallet_key, self.wallet_path)
+        if not self.did_checked:
+            if await get_did_from_wallet(self.wallet_handle, self.did) is None:
+                if self.did_seed is None:
+                    log.error("DID '{}' does not exist in wallet '{}'. A seed must be provided.".format(self.did, self.wallet_name))
+                    sys.exit(1)
+                await store_did(self.wallet_handle, self.did_seed)
+            self.did_checked = True
+
+    async def close(self):
+        """
+        Closes the wallet and pool handles, if they are open
+        """
+        if self.wallet_handle is not None:
+            log.debug("Closing wallet handle: {}".format(self.wallet_handle))
+            await wallet.close_wallet(self.wallet_handle)
+            self.wallet_handle = None
+        if self.pool_handle is not None:
+            log.debug("Closing pool handle: {}".format(self.pool_handle))
+            await pool.close_pool_ledger(self.pool_handle)
+            self.pool_handle = None
+        self.did_checked = False
+
+    @timed('validator_info')
+    async def get_validator_info(self) -> dict:
+        """
+        Sends a validator-info request to every node of the pool
+
+        Returns a dictionary of node name to the raw reply string of that node
+        ('timeout' for nodes that did not answer)
+        """
+        await self.open()
+        log.debug("Building validator-info request for did: '{}'".format(self.did))
+        request = await ledger.build_get_validator_info_request(self.did)
+        log.debug("Submitting validator-info request to pool")
+        res = await ledger.sign_and_submit_request(
+            self.pool_handle,
+            self.wallet_handle,
+            self.did,
+            request
+        )
+        replies = json.loads(res)
+        self._set_node_names(replies)
+        return replies
+
+    def _set_node_names(self, replies: dict):
+        self.node_names = sorted(replies)
+        self.node_queries = 0
+
+    @timed('refresh_pool_ledger')
+    async def _refresh_pool_ledger(self):
+        await pool.refresh_pool_ledger(self.pool_handle)
+
+    async def _get_validator_info_from(self, node: str, request: str, timeout: int) -> tuple:
+        started = time.perf_counter()
+        try:
+            # libindy's own timeout is the deadline; wait_for only guards
+            # against a reply that never comes back from the library
+            res = await asyncio.wait_for(
+                ledger.submit_action(self.pool_handle, request, json.dumps([node]), timeout),
+                timeout + 1)
+            replies = json.loads(res)
+            reply = replies.get(node, res) if isinstance(replies, dict) else res
+        except asyncio.TimeoutError:
+            reply = 'timeout'
+        except indy.error.IndyError as e:
+            #307 means PoolLedgerTimeout
+            if e.error_code == 307:
+                reply = 'timeout'
+            else:
+                stats.record('validator_info_node', time.perf_counter() - started, error_name(e))
+                raise
+        latency = time.perf_counter() - started
+        stats.record('validator_info_node', latency, 'timeout' if reply == 'timeout' else None)
+        return node, reply, latency
+
+    async def _get_validator_info_from_all(self, request: str, timeout: int) -> dict:
+        started = time.perf_counter()
+        error = None
+        try:
+            res = await asyncio.wait_for(
+                ledger.submit_action(self.pool_handle, request, None, timeout),
+                timeout + 1)
+        except Exception as e:
+            error = error_name(e)
+            raise
+        finally:
+            stats.record('validator_info', time.perf_counter() - started, error)
+        replies = json.loads(res)
+        self._set_node_names(replies)
+        return replies
+
+    async def stream_validator_info(self, timeout: int = 10, nodes: list = None):
+        """
+        Sends a validator-info request to every node separately and yields
+        (node name, raw reply, seconds taken) for each node as soon as it
+        answers. A node that does not answer within 'timeout' seconds is
+        yielded with the reply 'timeout'.
+
+        Without 'nodes', the nodes seen by the last full request are queried.
+        If there was none, or NODE_REFRESH_QUERIES queries have been made
+        since, the pool ledger is refreshed and all nodes are asked at once to
+        learn their names, still waiting at most 'timeout' seconds; their
+        replies are yielded with None as the seconds taken, which are not
+        known per node.
+        """
+        await self.open()
+        request = await ledger.build_get_validator_info_request(self.did)
+        request = await ledger.sign_request(self.wallet_handle, self.did, request)
+        if nodes is None:
+            if not self.node_names or self.node_queries >= NODE_REFRESH_QUERIES:
+                await self._refresh_pool_ledger()
+                replies = await self._get_validator_info_from_all(request, timeout)
+                for node, reply in replies.items():
+                    yield node, reply, None
+                return
+            self.node_queries += 1
+            nodes = self.node_names
+        pending = [self._get_validator_info_from(node, request, timeout) for node in nodes]
+        for next_reply in asyncio.as_completed(pending):
+            yield await next_reply
+
+    async def get_attrib(self, attrib: str, target_did: str = None) -> dict:
+        """
+        Requests the attrib 'attrib' of 'target_did' (default: the signing DID)
+        """
+        await self.open()
+        return await get_attrib(self.pool_handle, target_did or self.did, attrib)
+
+    async def set_attrib(self, attrib: str) -> dict:
+        """
+        Sets the attrib 'attrib' on the signing DID
+        """
+        await self.open()
+        return await set_attrib(self.pool_handle, self.wallet_handle, self.did, attrib)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Per-node metrics picked out of a validator-info tree
+"""
+
+
+# Subtrees of the validator-info data node_metrics reads
+METRIC_PATHS = [
+    ['Node_info', 'Metrics'],
+    ['Node_info', 'Replicas_status'],
+    ['Node_info', 'View_change_status'],
+    ['Pool_info'],
+    ['Software'],
+]
+
+
+def get_path(tree, path):
+    """
+    Returns the value at 'path' (a sequence of keys) in 'tree', or None if
+    any step is missing
+    """
+    for step in path:
+        try:
+            tree = tree[step]
+        except (KeyError, TypeError, IndexError):
+            return None
+    return tree
+
+
+def node_metrics(node: str, data: dict) -> dict:
+    """
+    Returns a flat dictionary of metric name to value for one node's
+    validator-info data. Numbers (and booleans, as 0/1) are kept as numbers,
+    versions and primaries as strings. Metrics missing from the data are left
+    out.
+    """
+    metrics = {}
+    trans_count = get_path(data, ['Node_info', 'Metrics', 'transaction-count'])
+    if isinstance(trans_count, dict):
+        for ledger, count in trans_count.items():
+            metrics['transaction-count.{}'.format(ledger)] = count
+    candidates = {
+        'reachable-nodes': ['Pool_info', 'Reachable_nodes_count'],
+        'unreachable-nodes': ['Pool_info', 'Unreachable_nodes_count'],
+        'total-nodes': ['Pool_info', 'Total_nodes_count'],
+        'primary': ['Node_info', 'Replicas_status', '{}:0'.format(node), 'Primary'],
+        'view-no': ['Node_info', 'View_change_status', 'View_No'],
+        'view-change-in-progress': ['Node_info', 'View_change_status', 'VC_in_progress'],
+        'version.indy-node': ['Software', 'indy-node'],
+        'version.sovrin': ['Software', 'sovrin'],
+    }
+    for name, path in candidates.items():
+        value = get_path(data, path)
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        metrics[name] = value
+    return metrics
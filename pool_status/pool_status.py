@@ -3,12 +3,18 @@
 import json
 import copy
 import argparse
-import re
-import codecs
 import copy
 import readline
 import getpass
+import os
 from helper_functions import *
+from validator_info import parse_node_validator_info, parse_validator_info, WALLET_KEY_ENV
+from metrics import METRIC_PATHS, node_metrics
+from snapshot_archive import SnapshotArchive, load_snapshot
+from timeseries import TimeSeriesStore
+from field_index import build_indexes
+from snapshot_diff import diff_snapshots, print_diff
+import aggregates
 from logging.handlers import RotatingFileHandler
 
 
@@ -25,59 +31,109 @@ console_handler=logging.StreamHandler()
 console_handler.setLevel(logging.ERROR)
 log.addHandler(console_handler)
 
-pattern1 = re.compile(r'\\u251c[^ ]*')
-pattern2 = re.compile(r'\\u25cf[^ ]*')
-pattern3 = re.compile(r'\\u2514[^ ]*')
-pool_handle = None
-wallet_handle = None
+session = None
 
-def remove_json_cruft(line):
-    line = codecs.escape_decode(line)[0].decode('ascii', 'ignore')
-    line = pattern1.sub(r"", line)
-    line = pattern2.sub(r"", line)
-    line = pattern3.sub(r"", line)
-    line = line.replace(r'\/', '/')                        # removes \ on \/
-    line = line.replace('\n', '    ')                      # json parser chokes on \n, \t
-    line = line.replace('\t', '    ')
-    return line
 
+async def get_validator_info_async(session, paths=None):
+    """
+    Queries every node of the pool through an open PoolSession
+    """
+    return parse_validator_info(await session.get_validator_info(), paths)
 
-def get_validator_info(pool, wallet, walletKey, did, genesisFile = None, didSeed = None):
 
-    global pool_handle, wallet_handle
+async def stream_validator_info_async(session, node_timeout, report=False, paths=None):
+    """
+    Queries every node separately, giving each one at most 'node_timeout'
+    seconds. With 'report', every node is printed with its latency as soon as
+    it answers. With 'paths', only those subtrees are kept.
+
+    Returns a tuple of the validator-info data of the nodes that answered and
+    a dict of node name to seconds taken. Nodes are left out of the latter
+    whenever the session learns the node names again from a request to all
+    nodes at once (see PoolSession.stream_validator_info).
+    """
+    parsedJson = {}
+    latencies = {}
+    async for key, value, latency in session.stream_validator_info(node_timeout):
+        if latency is not None:
+            latencies[key] = latency
+        data = parse_node_validator_info(key, value, paths)
+        if data is not None:
+            parsedJson[key] = data
+            if report and latency is not None:
+                print("{:<30} {:>8.2f}s".format(key, latency))
+            elif report:
+                print(key)
+    log.debug(json.dumps({'validator_info_latency': latencies}))
+    return parsedJson, latencies
+
+
+def get_validator_info(pool, wallet, walletKey, did, genesisFile = None, didSeed = None, nodeTimeout = None):
+    """
+    Blocking entry point for the REPL. The pool, wallet and DID are only
+    opened and checked on the first call; later calls reuse the same session.
+    With 'nodeTimeout', nodes are queried separately and reported as they
+    answer, so a slow node only delays itself.
+    """
+    global session
+    if session is None:
+        session = PoolSession(pool, wallet, walletKey, did, genesisFile, didSeed)
     looper = asyncio.get_event_loop()
-    looper.run = looper.run_until_complete
+    if nodeTimeout is None:
+        info = looper.run_until_complete(get_validator_info_async(session))
+    else:
+        info, _ = looper.run_until_complete(stream_validator_info_async(session, nodeTimeout, report=True))
+    log.info(json.dumps(info))
+    return info
 
-    if pool_handle == None:
-        pool_handle = looper.run(open_pool(pool, genesisFile))
-    if wallet_handle == None:
-        wallet_handle = looper.run(open_wallet(wallet, walletKey))
-    if looper.run(get_did_from_wallet(wallet_handle, did)) == None:
-        if didSeed == None:
-            log.error("DID '{}' does not exist in wallet '{}'. A seed must be provided.".format(did, wallet))
-            sys.exit(1)
-        else:
-            looper.run(store_did(wallet_handle, didSeed))
 
-    v_i_request = looper.run(ledger.build_get_validator_info_request(did))
-    vi = looper.run(ledger.sign_and_submit_request(pool_handle,wallet_handle,did,v_i_request))
-    jsonStrings = json.loads(vi)
-    parsedJson = {}
-    for key,value in jsonStrings.items():
-        value = remove_json_cruft(value)
-        if value == 'timeout':
-            print("Warning: Node '{}' is unreachable and will be excluded.".format(key))
-        else:
-            parsedValue = json.loads(value)
-            if 'result' in parsedValue:
-                parsedJson[key] = parsedValue['result']['data']
-            elif 'reason' in parsedValue and 'UnauthorizedClientRequest' in parsedValue['reason']:
-                print("Error: You must use steward keys to execute this script")
-                sys.exit(1)
+async def poll_forever(session, store, interval, node_timeout=None, archive=None):
+    """
+    Daemon mode: collects validator-info every 'interval' seconds and appends
+    the metrics of every node to 'store'. With 'node_timeout', nodes are
+    queried separately and their latency is stored as well. With 'archive',
+    every full snapshot is appended to that SnapshotArchive; otherwise only
+    the subtrees the metrics are read from are parsed.
+    """
+    paths = None if archive is not None else METRIC_PATHS
+    while True:
+        started = time.time()
+        try:
+            if node_timeout is None:
+                info = await get_validator_info_async(session, paths)
+                latencies = {}
             else:
-                print("Warning: Status for {} will be excluded due to unexpected result: {}".format(key, value))
-    log.info(json.dumps(parsedJson))
-    return parsedJson
+                info, latencies = await stream_validator_info_async(session, node_timeout, paths=paths)
+            samples = {node: node_metrics(node, data) for node, data in info.items()}
+            for node, latency in latencies.items():
+                samples.setdefault(node, {})['validator-info-latency'] = latency
+            store.append(started, samples)
+            store.compact()
+            if archive is not None:
+                archive.append(info, started)
+            log.info("Stored metrics of {} nodes".format(len(info)))
+            stats.log_summary()
+        except Exception as e:
+            log.error("Polling the pool failed: {}".format(e))
+        await asyncio.sleep(max(0, interval - (time.time() - started)))
+
+
+def run_daemon(args, walletKey, didSeed):
+    global session
+    session = PoolSession(args.pool, args.wallet, walletKey, args.did, args.genesisFile, didSeed)
+    store = TimeSeriesStore(args.store, args.rawRetention, args.bucket, args.retention)
+    archive = SnapshotArchive(args.archive) if args.archive else None
+    looper = asyncio.get_event_loop()
+    try:
+        looper.run_until_complete(poll_forever(session, store, args.interval, args.nodeTimeout, archive))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        looper.run_until_complete(session.close())
+        store.close()
+        if archive is not None:
+            archive.close()
+
 
 def parse_inputs():
     parser = argparse.ArgumentParser(
@@ -87,45 +143,52 @@ def parse_inputs():
     parser.add_argument('did', help='DID of steward')
     parser.add_argument('--genesisFile', help='Needed if the pool has not been previously initialized.')
     parser.add_argument('--didSeed', action='store_true', help='Prompt for seed. Use if keys are not yet in your wallet')
-    parser.add_argument('--infoFile', help='Get validator info from this JSON file, instead of querying pool. Use of this option means that all other arguments are ignored')
+    parser.add_argument('--infoFile', help='Get validator info from this JSON file or snapshot archive (<archive>@<id> for a given snapshot, the latest otherwise), instead of querying pool. Use of this option means that all other arguments are ignored')
+    parser.add_argument('--nodeTimeout', type=int, default=None, help='Query every node separately, waiting at most this many seconds for each, and show nodes as they answer together with their latency')
+    parser.add_argument('--daemon', action='store_true', help='Do not start the shell. Poll the pool every --interval seconds and store per-node metrics in --store instead. The wallet key is read from the {} environment variable if it is set.'.format(WALLET_KEY_ENV))
+    parser.add_argument('--interval', type=int, default=300, help='Seconds between two polls in daemon mode (default: 300)')
+    parser.add_argument('--store', default='pool_status.db', help='Time-series file used in daemon mode (default: pool_status.db)')
+    parser.add_argument('--rawRetention', type=int, default=86400, help='Seconds to keep every raw sample before downsampling it (default: 1 day)')
+    parser.add_argument('--bucket', type=int, default=3600, help='Width in seconds of a downsampled sample (default: 1 hour)')
+    parser.add_argument('--retention', type=int, default=365 * 86400, help='Seconds to keep samples at all (default: 1 year)')
+    parser.add_argument('--archive', help='In daemon mode, also append every snapshot to this compressed snapshot archive')
     args = parser.parse_args()
 
     return args
 
-def add_branch(path, full_branch, destination):
-    source_branch = full_branch
+def add_branch(path, index, destination):
+    full_path = '/'.join(path)
+    if full_path not in index:
+        print("Invalid field requested: {}".format(':'.join(path)))
+        return
     dest_branch = destination
-    for step in path:
-        try:
-            source_branch = source_branch[step]
-        except:
-            print("Invalid field requested: {}".format(':'.join(path)))
-            return
-        if step == path[-1]:
-            dest_branch[step] = copy.copy(source_branch)
-        elif step not in dest_branch.keys():
+    for step in path[:-1]:
+        if not isinstance(dest_branch.get(step), dict):
             dest_branch[step] = {}
         dest_branch = dest_branch[step]
+    dest_branch[path[-1]] = copy.copy(index.get(full_path))
 
-def make_pruned_tree(field_array, node, full_branch):
+def make_pruned_tree(field_array, node, index):
     destination = {}
     for field in field_array:
         if field == 'transCount':
-            add_branch(['Node_info','Metrics','transaction-count'], full_branch, destination)
+            add_branch(['Node_info','Metrics','transaction-count'], index, destination)
         elif field == 'reachable':
-            add_branch(['Pool_info','Reachable_nodes_count'], full_branch, destination)
-            add_branch(['Pool_info','Unreachable_nodes_count'], full_branch, destination)
-            add_branch(['Pool_info','Unreachable_nodes'], full_branch, destination)
+            add_branch(['Pool_info','Reachable_nodes_count'], index, destination)
+            add_branch(['Pool_info','Unreachable_nodes_count'], index, destination)
+            add_branch(['Pool_info','Unreachable_nodes'], index, destination)
         elif field == 'version':
-            add_branch(['Software','indy-node'], full_branch, destination)
-            add_branch(['Software','sovrin'], full_branch, destination)
+            add_branch(['Software','indy-node'], index, destination)
+            add_branch(['Software','sovrin'], index, destination)
         elif field == 'primary':
-            add_branch(['Node_info','Replicas_status','{}:0'.format(node),'Primary'], full_branch, destination)
+            add_branch(['Node_info','Replicas_status','{}:0'.format(node),'Primary'], index, destination)
         else:
-            add_branch(field.split('/'), full_branch, destination)
+            add_branch(field.split('/'), index, destination)
     return destination
 
-def find_and_print(info, fields, nodes):
+def find_and_print(info, fields, nodes, indexes=None):
+    if indexes is None:
+        indexes = build_indexes(info)
     field_array = fields.split(',')
     node_array = nodes.split(',')
     if 'all' in node_array:
@@ -136,15 +199,15 @@ def find_and_print(info, fields, nodes):
         if 'all' in field_array: # no need to look further if 'all' fields are requested
             pruned[node] = info[node]
         else:
-            if info[node] == 'timeout':
+            if node not in indexes:
                 pruned[node] = info[node]
             else:
-                pruned[node] = make_pruned_tree(field_array, node, info[node])
+                pruned[node] = make_pruned_tree(field_array, node, indexes[node])
     print(json.dumps(pruned, sort_keys=True, indent=4))
 
 
 def print_help():
-    print('The available commands are nodes, show, save, reload, help, and quit.')
+    print('The available commands are nodes, show, save, archive, diff, agg, reload, timings, help, and quit.')
     print('First use the nodes command to set for which nodes the stats should be displayed.')
     print('   Example: "> nodes validator01,validator02"')
     print('   "nodes all" will display info for all nodes in the pool. (This is the default)')
@@ -157,10 +220,29 @@ def print_help():
     print('If at some time you want to query the pool to update the status information, use the "reload" command.')
     print('To save the data retrieved from the ledger for later offline analysis with this or other tools, use save.')
     print('   Example: > save myfile.json')
+    print('To keep many snapshots compactly, append them to a snapshot archive with archive, optionally giving a label.')
+    print('   Unchanged parts of each node are stored only once. Wherever a file is read, <archive>@<id> selects one of its snapshots.')
+    print('   Example: > archive pool.archive after-upgrade')
+    print('To compare a saved snapshot with the current data, use diff. Give a second file to compare two saved snapshots instead.')
+    print('   Version, primary, reachability and ledger size changes are listed; add "all" to list every changed field.')
+    print('   Example: > diff yesterday.json')
+    print('   Example: > diff yesterday.json today.json all')
+    print('   Example: > diff pool.archive@12')
+    print('To compare one field across the selected nodes, use agg with an operator and a field.')
+    print('   "stats" gives count/min/max/median/mean, "group" groups the nodes by value and "deviants" lists the nodes')
+    print('   that differ from the majority value (optionally give a tolerance for numbers). The field is a slash')
+    print('   delimited path, or one of "transCount", "version", "primary" and "reachable".')
+    print('   Example: > agg deviants transCount 10')
+    print('   Example: > agg group version')
+    print('To see how long the calls to the pool and wallet took so far (count, errors, mean, p50, p95, max and total), use timings.')
+    print('   "timings json" prints the full histograms and "timings reset" starts counting afresh.')
     print("")
 
-commands = ['nodes', 'show', 'save', 'reload', 'help', 'quit']
+commands = ['nodes', 'show', 'save', 'archive', 'diff', 'agg', 'reload', 'timings', 'help', 'quit']
+agg_operators = ['stats', 'group', 'deviants']
+shortcuts = ['all', 'transCount', 'reachable', 'version', 'primary']
 info = {}
+indexes = {}
 nothing = []
 
 def completer(text, state):
@@ -179,23 +261,13 @@ def completer(text, state):
             field = parts[1].split(',')[-1]
             log.debug('Checking for field {}'.format(field))
             subparts = field.split('/')
-            treepointer = info[nodes[0]]
-            for subpart in subparts[0:-1]:
-                log.debug('Looking for completions to {} in {}'.format(subpart, json.dumps(list(treepointer.keys()))))
-                try:
-                    treepointer = treepointer[subpart]
-                except:
-                    options = [x for x in nothing if x.startswith(text)]
+            parent = '/'.join(subparts[0:-1])
+            index = next(iter(indexes.values()), None)
+            options = index.children_of(parent, text) if index is not None else []
             if len(subparts) == 1:
-                mylist = list(treepointer.keys())
-                mylist.append('all')
-                mylist.append('transCount')
-                mylist.append('reachable')
-                mylist.append('version')
-                mylist.append('primary')
-                options = [x for x in mylist if x.startswith(text)]
-            else:
-                options = [x for x in treepointer.keys() if x.startswith(text)]
+                options = options + [x for x in shortcuts if x.startswith(text)]
+        elif parts[0] == 'agg':
+            options = [x for x in agg_operators if x.startswith(text)]
         elif parts[0] == 'nodes':
             log.debug('c7')
             options = [x for x in nodes if x.startswith(text)]
@@ -218,16 +290,22 @@ if __name__ == '__main__':
     args=parse_inputs()
     if (args.infoFile):
         print('An input file has been provided. All other arguments will be ignored. Loading file...')
-        with open(args.infoFile) as infoStream:
-            info = json.load(infoStream)
+        info = load_snapshot(args.infoFile)
+        indexes = build_indexes(info)
     else:
         if args.didSeed:
             didSeed = getpass.getpass("DID seed: ")
         else:
             didSeed = None
-        walletKey = getpass.getpass("Wallet key: ")
+        walletKey = os.environ.get(WALLET_KEY_ENV) if args.daemon else None
+        if walletKey is None:
+            walletKey = getpass.getpass("Wallet key: ")
+        if args.daemon:
+            run_daemon(args, walletKey, didSeed)
+            sys.exit(0)
         print('Please be patient while I contact all the nodes in the pool for their status...')
-        info = get_validator_info(args.pool, args.wallet, walletKey, args.did, args.genesisFile, didSeed)
+        info = get_validator_info(args.pool, args.wallet, walletKey, args.did, args.genesisFile, didSeed, args.nodeTimeout)
+        indexes = build_indexes(info)
     nodes='all'
     action=''
     readline.set_completer(completer)
@@ -256,7 +334,7 @@ if __name__ == '__main__':
                 print('Input error: "nodes" command requires one argument')
         elif action == 'show':
             if len(command) == 2:
-                find_and_print(info, command[1], nodes)
+                find_and_print(info, command[1], nodes, indexes)
             else:
                 print('Input error: "show" command requires one argument')
         elif action == 'save':
@@ -265,9 +343,67 @@ if __name__ == '__main__':
                     json.dump(info, infoStream)
             else:
                 print('Input error: "save" command requires one argument')
+        elif action == 'archive':
+            if len(command) in (2, 3):
+                archive = SnapshotArchive(command[1])
+                try:
+                    snapshot_id = archive.append(info, label=command[2] if len(command) == 3 else None)
+                finally:
+                    archive.close()
+                print('Saved as snapshot {} of {}'.format(snapshot_id, command[1]))
+            else:
+                print('Input error: "archive" command requires a file and optionally a label')
+        elif action == 'agg':
+            if len(command) in (3, 4) and command[1] in agg_operators:
+                selected = None if nodes == 'all' else nodes.split(',')
+                values = aggregates.column(indexes, command[2], selected)
+                if command[1] == 'stats':
+                    print(json.dumps(aggregates.stats(values), indent=4))
+                elif command[1] == 'group':
+                    print(json.dumps(aggregates.group_by(values), indent=4))
+                else:
+                    try:
+                        tolerance = float(command[3]) if len(command) == 4 else None
+                    except ValueError:
+                        print('Input error: tolerance must be a number')
+                        continue
+                    majority, deviating = aggregates.deviants(values, tolerance)
+                    print(json.dumps({'majority': majority, 'deviating': deviating}, indent=4))
+            else:
+                print('Input error: "agg" command requires an operator ({}) and a field'.format(', '.join(agg_operators)))
+        elif action == 'diff':
+            show_other = command[-1] == 'all'
+            files = command[1:-1] if show_other else command[1:]
+            if len(files) in (1, 2):
+                try:
+                    old_info = load_snapshot(files[0])
+                    if len(files) == 2:
+                        new_info = load_snapshot(files[1])
+                    else:
+                        new_info = info
+                except (OSError, ValueError) as e:
+                    print('Could not load snapshot: {}'.format(e))
+                    continue
+                result = diff_snapshots(old_info, new_info)
+                if nodes != 'all':
+                    selected = nodes.split(',')
+                    result = {node: change for node, change in result.items() if node in selected}
+                print_diff(result, show_other)
+            else:
+                print('Input error: "diff" command requires one or two files')
         elif action == 'reload':
             print('Please be patient while I contact all the nodes in the pool for their status...')
-            info = get_validator_info(args.pool, args.wallet, walletKey, args.did, args.genesisFile, didSeed)
+            info = get_validator_info(args.pool, args.wallet, walletKey, args.did, args.genesisFile, didSeed, args.nodeTimeout)
+            indexes = build_indexes(info)
+        elif action == 'timings':
+            if len(command) == 1:
+                print(stats.dump())
+            elif command[1] == 'json':
+                print(json.dumps(stats.as_dict(), sort_keys=True, indent=4))
+            elif command[1] == 'reset':
+                stats.reset()
+            else:
+                print('Input error: "timings" command takes no argument, "json" or "reset"')
         elif action == 'help':
             print_help()
         elif action == 'quit':
@@ -275,3 +411,6 @@ if __name__ == '__main__':
         else:
             print("Invalid instruction: {}".format(result))
             print_help()
+    if session is not None:
+        asyncio.get_event_loop().run_until_complete(session.close())
+        stats.log_summary()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Compressed archive of validator-info snapshots
+
+Snapshots are kept in a single sqlite file. Every node's data is split into
+its top level sections (Node_info, Pool_info, Software, ...) and every
+section into its parts (Node_info/Metrics, Node_info/Catchup_status, ...).
+Each part is stored once as a zlib compressed chunk, found by the hash of its
+content. A part that did not change since an earlier snapshot only adds a
+reference to the existing chunk. Sections such as Node_info or Hardware
+change on every poll, but mostly in one or two of their parts, so a year of
+hourly snapshots mostly costs the parts that actually moved.
+
+The references of one node in one snapshot form its manifest, a chunk of its
+own mapping section and part to chunk id. The 'entries' table indexes the
+manifest of every node in every snapshot. Loading one snapshot, or the
+history of one node, only reads and decompresses the chunks it needs.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+
+# Decompressed chunks kept in memory. Unchanged parts are shared between
+# snapshots, so loading a run of snapshots decompresses each of them once.
+CACHE_SIZE = 1024
+
+# Section (or part) name used for data that is stored whole: node data or a
+# section that is not a dictionary (e.g. 'timeout'), is empty, or has a key
+# of that very name
+WHOLE = ''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    snapshot INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    manifest INTEGER NOT NULL,
+    PRIMARY KEY (snapshot, node)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_node ON entries (node, snapshot);
+"""
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_archive(path: str) -> bool:
+    """
+    Tells an archive apart from a plain JSON snapshot written by 'save'
+    """
+    try:
+        with open(path, 'rb') as stream:
+            return stream.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+
+
+def split_sections(data) -> dict:
+    """
+    Splits node data into its sections, or a section into its parts
+    """
+    if isinstance(data, dict) and data and WHOLE not in data:
+        return data
+    return {WHOLE: data}
+
+
+def join_sections(sections: dict):
+    if list(sections) == [WHOLE]:
+        return sections[WHOLE]
+    return sections
+
+
+def join_parts(sections: dict):
+    """
+    Rebuilds node data from a dictionary of section to part to value
+    """
+    return join_sections({section: join_sections(parts) for section, parts in sections.items()})
+
+
+def split_parts(data) -> dict:
+    """
+    Splits node data into a dictionary of section to part to value
+    """
+    return {str(section): {str(part): value for part, value in split_sections(section_data).items()}
+            for section, section_data in split_sections(data).items()}
+
+
+class SnapshotArchive(object):
+    """
+    Appends snapshots (dictionaries of node name to validator-info data) and
+    loads them back, whole or per node
+    """
+
+    def __init__(self, path: str, level: int = 6):
+        self.level = level
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        self._chunks = OrderedDict()
+
+    def close(self):
+        self._db.close()
+
+    def _store_chunk(self, value) -> int:
+        encoded = _encode(value)
+        digest = hashlib.blake2b(encoded, digest_size=16).digest()
+        known = self._db.execute('SELECT id FROM chunks WHERE hash = ?', (digest,)).fetchone()
+        if known is not None:
+            return known[0]
+        cursor = self._db.execute('INSERT INTO chunks (hash, data) VALUES (?, ?)',
+                                  (digest, zlib.compress(encoded, self.level)))
+        return cursor.lastrowid
+
+    def _load_chunk(self, chunk_id: int):
+        if chunk_id in self._chunks:
+            self._chunks.move_to_end(chunk_id)
+            return self._chunks[chunk_id]
+        row = self._db.execute('SELECT data FROM chunks WHERE id = ?', (chunk_id,)).fetchone()
+        value = json.loads(zlib.decompress(row[0]).decode())
+        self._chunks[chunk_id] = value
+        if len(self._chunks) > CACHE_SIZE:
+            self._chunks.popitem(last=False)
+        return value
+
+    def _load_node(self, manifest_id: int, section: str = None):
+        """
+        Returns the node data of a manifest, or only 'section' of it (None if
+        the node has no such section)
+        """
+        manifest = self._load_chunk(manifest_id)
+        if section is not None:
+            if section not in manifest:
+                return None
+            return join_sections({part: self._load_chunk(chunk_id) for part, chunk_id in manifest[section].items()})
+        return join_parts({name: {part: self._load_chunk(chunk_id) for part, chunk_id in parts.items()}
+                           for name, parts in manifest.items()})
+
+    def append(self, info: dict, ts: float = None, label: str = None) -> int:
+        """
+        Stores 'info' as a new snapshot and returns its id
+        """
+        if ts is None:
+            ts = time.time()
+        with self._db:
+            cursor = self._db.execute('INSERT INTO snapshots (ts, label) VALUES (?, ?)', (ts, label))
+            snapshot_id = cursor.lastrowid
+            rows = []
+            for node, data in info.items():
+                manifest = {section: {part: self._store_chunk(value) for part, value in parts.items()}
+                            for section, parts in split_parts(data).items()}
+                rows.append((snapshot_id, node, self._store_chunk(manifest)))
+            self._db.executemany('INSERT INTO entries (snapshot, node, manifest) VALUES (?, ?, ?)', rows)
+        return snapshot_id
+
+    def snapshots(self) -> list:
+        """
+        Returns (id, timestamp, label) of every snapshot, oldest first
+        """
+        return self._db.execute('SELECT id, ts, label FROM snapshots ORDER BY id').fetchall()
+
+    def latest(self):
+        row = self._db.execute('SELECT MAX(id) FROM snapshots').fetchone()
+        return row[0]
+
+    def nodes(self, snapshot_id: int = None) -> list:
+        if snapshot_id is None:
+            rows = self._db.execute('SELECT DISTINCT node FROM entries ORDER BY node')
+        else:
+            rows = self._db.execute('SELECT DISTINCT node FROM entries WHERE snapshot = ? ORDER BY node', (snapshot_id,))
+        return [node for node, in rows]
+
+    def load(self, snapshot_id: int = None, nodes: list = None) -> dict:
+        """
+        Returns one snapshot (default: the latest) as a dictionary of node name
+        to validator-info data, optionally only for the given nodes
+        """
+        if snapshot_id is None:
+            snapshot_id = self.latest()
+            if snapshot_id is None:
+                return {}
+        query = 'SELECT node, manifest FROM entries WHERE snapshot = ?'
+        params = [snapshot_id]
+        if nodes is not None:
+            query += ' AND node IN ({})'.format(','.join('?' * len(nodes)))
+            params.extend(nodes)
+        query += ' ORDER BY node'
+        return {node: self._load_node(manifest) for node, manifest in self._db.execute(query, params)}
+
+    def history(self, node: str, section: str = None, since: float = None, until: float = None):
+        """
+        Yields (snapshot id, timestamp, data) for every snapshot holding
+        'node', oldest first. With 'section', data is only that section.
+        """
+        query = ('SELECT e.snapshot, s.ts, e.manifest FROM entries e '
+                 'JOIN snapshots s ON s.id = e.snapshot WHERE e.node = ?')
+        params = [node]
+        if since is not None:
+            query += ' AND s.ts >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND s.ts <= ?'
+            params.append(until)
+        query += ' ORDER BY e.snapshot'
+        for snapshot_id, ts, manifest in self._db.execute(query, params).fetchall():
+            data = self._load_node(manifest, section)
+            if section is None or data is not None:
+                yield snapshot_id, ts, data
+
+
+def load_snapshot(spec: str) -> dict:
+    """
+    Loads a snapshot from a JSON file written by 'save', or from an archive.
+    '<archive>@<id>' selects a snapshot of the archive, a bare archive path
+    the latest one.
+    """
+    path, _, snapshot_id = spec.rpartition('@')
+    if not path or not is_archive(path):
+        path, snapshot_id = spec, None
+    if is_archive(path):
+        archive = SnapshotArchive(path)
+        try:
+            return archive.load(int(snapshot_id) if snapshot_id else None)
+        finally:
+            archive.close()
+    with open(path) as infoStream:
+        return json.load(infoStream)
+
+
+def parse_inputs():
+    parser = argparse.ArgumentParser(description='Manage a compressed archive of validator-info snapshots.')
+    parser.add_argument('archive', help='The archive file')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('list', help='List the snapshots in the archive')
+    add = subparsers.add_parser('add', help='Add JSON snapshots written by "save", in the given order')
+    add.add_argument('files', nargs='+')
+    export = subparsers.add_parser('export', help='Print one snapshot as JSON')
+    export.add_argument('snapshot', nargs='?', type=int, help='Snapshot id (default: the latest)')
+    export.add_argument('--nodes', help='Comma delimited nodes to export')
+    history = subparsers.add_parser('history', help="Print one node's data across snapshots as JSON lines")
+    history.add_argument('node')
+    history.add_argument('--section', help='Only this top level section, e.g. Node_info')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_inputs()
+    archive = SnapshotArchive(args.archive)
+    try:
+        if args.command == 'list':
+            for snapshot_id, ts, label in archive.snapshots():
+                print('{:>6}  {}  {}'.format(snapshot_id, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)), label or ''))
+        elif args.command == 'add':
+            for path in args.files:
+                with open(path) as infoStream:
+                    info = json.load(infoStream)
+                snapshot_id = archive.append(info, os.path.getmtime(path), path)
+                print('Added {} as snapshot {}'.format(path, snapshot_id))
+        elif args.command == 'export':
+            nodes = args.nodes.split(',') if args.nodes else None
+            print(json.dumps(archive.load(args.snapshot, nodes), sort_keys=True, indent=4))
+        elif args.command == 'history':
+            for snapshot_id, ts, data in archive.history(args.node, args.section):
+                print(json.dumps({'snapshot': snapshot_id, 'ts': ts, 'data': data}, sort_keys=True))
+    finally:
+        archive.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Structural diff of two validator-info snapshots
+
+Subtrees are compared with == before the diff descends into them. The
+comparison runs in C and stops at the first difference, so the unchanged
+branches of large dumps are skipped instead of being walked leaf by leaf.
+"""
+
+import json
+
+from field_index import join_path
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+# Leaves worth calling out, checked in this order against the changed path
+CATEGORIES = [
+    ('version', lambda path: path.startswith('Software/')),
+    ('primary', lambda path: path.startswith('Node_info/Replicas_status/') and path.endswith('/Primary')),
+    ('reachability', lambda path: path.startswith('Pool_info/') and 'eachable' in path),
+    ('ledger size', lambda path: path.startswith('Node_info/Metrics/transaction-count/')),
+]
+OTHER = 'other'
+
+
+def categorize(path: str) -> str:
+    for category, matches in CATEGORIES:
+        if matches(path):
+            return category
+    return OTHER
+
+
+def diff_trees(old, new) -> list:
+    """
+    Returns the changed leaves between two trees as a sorted list of
+    (path, old value, new value). A missing side is None.
+    """
+    changes = []
+    stack = [('', old, new)]
+    while stack:
+        path, old_branch, new_branch = stack.pop()
+        if old_branch == new_branch:
+            continue
+        if isinstance(old_branch, dict) and isinstance(new_branch, dict):
+            for key in set(old_branch) | set(new_branch):
+                stack.append((join_path(path, key), old_branch.get(key), new_branch.get(key)))
+        else:
+            changes.append((path, old_branch, new_branch))
+    changes.sort(key=lambda change: change[0])
+    return changes
+
+
+def diff_snapshots(old_info: dict, new_info: dict) -> dict:
+    """
+    Compares two snapshots (dictionaries of node name to validator-info data)
+
+    Returns a dictionary of node name to (status, changes) for every node that
+    differs, where status is 'added', 'removed' or 'changed' and changes is
+    the list returned by diff_trees
+    """
+    result = {}
+    for node in sorted(set(old_info) | set(new_info)):
+        if node not in old_info:
+            result[node] = (ADDED, [])
+        elif node not in new_info:
+            result[node] = (REMOVED, [])
+        else:
+            changes = diff_trees(old_info[node], new_info[node])
+            if changes:
+                result[node] = (CHANGED, changes)
+    return result
+
+
+def describe_change(path: str, old, new) -> str:
+    text = '{}: {} -> {}'.format(path, json.dumps(old), json.dumps(new))
+    numbers = (int, float)
+    if isinstance(old, numbers) and isinstance(new, numbers) and not isinstance(old, bool) and not isinstance(new, bool):
+        text += ' ({:+})'.format(new - old)
+    return text
+
+
+def print_diff(result: dict, show_other: bool = False):
+    """
+    Prints the result of diff_snapshots grouped by node and category. Changes
+    outside the known categories are only counted unless show_other is set.
+    """
+    if not result:
+        print('No differences')
+        return
+    for node, (status, changes) in result.items():
+        if status != CHANGED:
+            print('{}: node {}'.format(node, status))
+            continue
+        print('{}:'.format(node))
+        others = 0
+        for path, old, new in changes:
+            category = categorize(path)
+            if category == OTHER and not show_other:
+                others += 1
+                continue
+            print('    {:<13}{}'.format(category, describe_change(path, old, new)))
+        if others:
+            print('    {:<13}{} more changed fields'.format(OTHER, others))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Compact local time-series store for per-node pool metrics
+
+Samples are kept in a single sqlite file. Every (node, metric) pair is stored
+once in the 'series' table and samples only reference it by id. Numeric
+samples go in 'value', strings (versions, primaries) in 'text'.
+
+Raw samples older than 'raw_retention' seconds are downsampled into buckets
+of 'bucket' seconds (the average for numbers, the last value for strings), and
+downsampled buckets older than 'retention' seconds are deleted.
+"""
+
+import sqlite3
+import time
+
+RAW = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    node TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    UNIQUE (node, metric)
+);
+CREATE TABLE IF NOT EXISTS samples (
+    series INTEGER NOT NULL,
+    resolution INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL,
+    text TEXT,
+    PRIMARY KEY (series, resolution, ts)
+) WITHOUT ROWID;
+"""
+
+
+class TimeSeriesStore(object):
+    """
+    Appends and queries per-node metric samples
+
+    raw_retention: seconds raw samples are kept before being downsampled
+    bucket: width in seconds of a downsampled sample
+    retention: seconds any sample is kept at all
+    """
+
+    def __init__(self, path: str, raw_retention: int = 86400,
+                 bucket: int = 3600, retention: int = 365 * 86400):
+        if bucket < 1:
+            raise ValueError('Bucket width must be at least one second')
+        self.raw_retention = raw_retention
+        self.bucket = bucket
+        self.retention = retention
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        self._series = {}
+        for series_id, node, metric in self._db.execute('SELECT id, node, metric FROM series'):
+            self._series[(node, metric)] = series_id
+
+    def close(self):
+        self._db.close()
+
+    def _series_id(self, node: str, metric: str) -> int:
+        key = (node, metric)
+        if key not in self._series:
+            cursor = self._db.execute('INSERT INTO series (node, metric) VALUES (?, ?)', key)
+            self._series[key] = cursor.lastrowid
+        return self._series[key]
+
+    def append(self, ts: int, node_metrics: dict):
+        """
+        Stores one raw sample per metric. 'node_metrics' is a dictionary of
+        node name to a dictionary of metric name to value.
+        """
+        rows = []
+        for node, metrics in node_metrics.items():
+            for metric, value in metrics.items():
+                if isinstance(value, (int, float)):
+                    rows.append((self._series_id(node, metric), RAW, int(ts), value, None))
+                else:
+                    rows.append((self._series_id(node, metric), RAW, int(ts), None, str(value)))
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO samples (series, resolution, ts, value, text) VALUES (?, ?, ?, ?, ?)',
+                rows)
+
+    def compact(self, now: int = None):
+        """
+        Downsamples raw samples that are older than raw_retention and drops
+        everything older than retention
+        """
+        if now is None:
+            now = int(time.time())
+        # only whole buckets are downsampled, so a bucket never gets written twice
+        cutoff = (now - self.raw_retention) // self.bucket * self.bucket
+        with self._db:
+            self._db.execute("""
+                INSERT OR REPLACE INTO samples (series, resolution, ts, value, text)
+                SELECT s.series, :bucket, s.ts / :bucket * :bucket, AVG(s.value),
+                       (SELECT l.text FROM samples l
+                         WHERE l.series = s.series AND l.resolution = 0
+                           AND l.ts / :bucket = s.ts / :bucket
+                         ORDER BY l.ts DESC LIMIT 1)
+                  FROM samples s
+                 WHERE s.resolution = 0 AND s.ts < :cutoff
+                 GROUP BY s.series, s.ts / :bucket
+            """, {'bucket': self.bucket, 'cutoff': cutoff})
+            self._db.execute('DELETE FROM samples WHERE resolution = 0 AND ts < ?', (cutoff,))
+            self._db.execute('DELETE FROM samples WHERE ts < ?', (now - self.retention,))
+
+    def query(self, node: str, metric: str, since: int = 0, until: int = None) -> list:
+        """
+        Returns the samples of one node's metric as a time ordered list of
+        (ts, value) tuples, downsampled and raw samples alike
+        """
+        if until is None:
+            until = int(time.time())
+        series_id = self._series.get((node, metric))
+        if series_id is None:
+            return []
+        rows = self._db.execute(
+            'SELECT ts, value, text FROM samples WHERE series = ? AND ts BETWEEN ? AND ? ORDER BY ts, resolution DESC',
+            (series_id, since, until))
+        return [(ts, text if value is None else value) for ts, value, text in rows]
+
+    def nodes(self) -> list:
+        return sorted(set(node for node, _ in self._series))
+
+    def metrics(self, node: str) -> list:
+        return sorted(metric for series_node, metric in self._series if series_node == node)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Parsing of validator-info replies
+
+Every node answers a validator-info request with a JSON string whose text
+fields (mostly systemd status output) contain newlines, tabs and box drawing
+glyphs. The replies are decoded with a single json.loads and only the string
+leaves of the subtrees that were asked for are cleaned up afterwards.
+Callers that only need a few subtrees (the metrics of the daemon and the
+exporter) pass their paths, so the rest of every reply is never walked.
+"""
+
+import codecs
+import json
+import re
+import sys
+
+# Box drawing glyphs (and whatever is glued to them) from systemd output
+GLYPHS = re.compile('[├●└][^ ]*')
+# The same glyphs as they appear in the raw text before JSON decoding
+pattern1 = re.compile(r'\\u251c[^ ]*')
+pattern2 = re.compile(r'\\u25cf[^ ]*')
+pattern3 = re.compile(r'\\u2514[^ ]*')
+
+DATA_PATH = ('result', 'data')
+
+# Environment variable the daemon and the exporter read the wallet key from
+WALLET_KEY_ENV = 'POOL_STATUS_WALLET_KEY'
+
+
+def remove_json_cruft(line):
+    """
+    Slow, text based clean up of a reply. Only used when a reply cannot be
+    decoded directly.
+    """
+    line = codecs.escape_decode(line)[0].decode('ascii', 'ignore')
+    line = pattern1.sub(r"", line)
+    line = pattern2.sub(r"", line)
+    line = pattern3.sub(r"", line)
+    line = line.replace(r'\/', '/')                        # removes \ on \/
+    line = line.replace('\n', '    ')                      # json parser chokes on \n, \t
+    line = line.replace('\t', '    ')
+    return line
+
+
+def clean_string(value: str) -> str:
+    """
+    Cleans a single decoded string the same way remove_json_cruft cleans the
+    raw text
+    """
+    if '├' in value or '●' in value or '└' in value:
+        value = GLYPHS.sub('', value)
+    if '\n' in value or '\t' in value:
+        value = value.replace('\n', '    ').replace('\t', '    ')
+    return value
+
+
+def clean_tree(tree):
+    """
+    Returns a copy of 'tree' with every string leaf cleaned
+    """
+    if isinstance(tree, dict):
+        return {key: clean_tree(value) for key, value in tree.items()}
+    if isinstance(tree, list):
+        return [clean_tree(value) for value in tree]
+    if isinstance(tree, str):
+        return clean_string(tree)
+    return tree
+
+
+def decode_reply(reply: str) -> dict:
+    """
+    Decodes one node reply into a dict
+
+    Raises ValueError if the reply is not JSON, even after clean up
+    """
+    try:
+        # strict=False accepts the raw control characters found in the
+        # systemd output embedded in the reply
+        return json.loads(reply, strict=False)
+    except ValueError:
+        return clean_tree(json.loads(remove_json_cruft(reply)))
+
+
+def extract_paths(tree: dict, paths) -> dict:
+    """
+    Builds a tree holding only the subtrees found at 'paths' (sequences of
+    keys), with their string leaves cleaned. Missing paths are skipped.
+    """
+    pruned = {}
+    for path in paths:
+        source = tree
+        try:
+            for step in path:
+                source = source[step]
+        except (KeyError, TypeError):
+            continue
+        destination = pruned
+        for step in path[:-1]:
+            destination = destination.setdefault(step, {})
+        destination[path[-1]] = clean_tree(source)
+    return pruned
+
+
+def parse_node_reply(reply: str, paths=None) -> dict:
+    """
+    Decodes one node reply. If the reply carries validator-info data, only
+    that data (or, when 'paths' is given, only those subtrees of it) is
+    cleaned and returned under ['result']['data']; otherwise the decoded
+    reply is returned as is so the caller can inspect 'reason'.
+    """
+    parsed = decode_reply(reply)
+    try:
+        data = parsed['result']['data']
+    except (KeyError, TypeError):
+        return parsed
+    if paths is None:
+        data = clean_tree(data)
+    else:
+        data = extract_paths(data, paths)
+    parsed['result']['data'] = data
+    return parsed
+
+
+def parse_node_validator_info(key, value, paths=None):
+    """
+    Turns the raw reply of one node into its validator-info data (only the
+    subtrees at 'paths' if given), or None if the node has to be excluded
+    """
+    if value == 'timeout':
+        print("Warning: Node '{}' is unreachable and will be excluded.".format(key))
+        return None
+    try:
+        parsedValue = parse_node_reply(value, paths)
+    except ValueError:
+        print("Warning: Status for {} will be excluded due to unparsable result".format(key))
+        return None
+    if 'result' in parsedValue:
+        return parsedValue['result']['data']
+    elif 'reason' in parsedValue and 'UnauthorizedClientRequest' in parsedValue['reason']:
+        print("Error: You must use steward keys to execute this script")
+        sys.exit(1)
+    print("Warning: Status for {} will be excluded due to unexpected result: {}".format(key, value))
+    return None
+
+
+def parse_validator_info(replies, paths=None):
+    """
+    Turns the raw per-node replies of a validator-info request into a dict of
+    node name to validator-info data, keeping only the subtrees at 'paths' if
+    given
+    """
+    parsedJson = {}
+    for key,value in replies.items():
+        data = parse_node_validator_info(key, value, paths)
+        if data is not None:
+            parsedJson[key] = data
+    return parsedJson
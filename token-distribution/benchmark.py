@@ -0,0 +1,111 @@
+# Benchmark of the coin selection strategies. Builds synthetic wallets of
+# payment sources with mostly small and a few large amounts, then for each
+# strategy and a series of payment amounts
+#   - checks that the selection is valid (distinct sources covering the amount)
+#   - reports the time taken, the number of inputs and the change left over
+# No pool, wallet or payment library is needed.
+#
+# Run with: python3 benchmark.py [--sizes 1000,5000,20000] [--payments 50] [--seed 1]
+
+import argparse
+import random
+import time
+
+from coin_selection import LEDGER_ORDER, LARGEST_FIRST, EXACT_MATCH, MIN_INPUTS, AUTO, \
+    select_sources, plan_consolidation, total_amount
+from constants import MAX_INPUTS_PER_TRANSACTION
+
+STRATEGIES = [LEDGER_ORDER, LARGEST_FIRST, MIN_INPUTS, EXACT_MATCH, AUTO]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,20000',
+                        help='comma separated numbers of sources in the synthetic wallets')
+    parser.add_argument('--payments', type=int, default=50,
+                        help='number of payment amounts to select sources for')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the synthetic data')
+    return parser.parse_args()
+
+
+def make_sources(size, rng):
+    # Mostly small change from earlier payments, with some larger sources
+    sources = []
+    for i in range(size):
+        if rng.random() < 0.9:
+            amount = rng.randint(1, 100)
+        else:
+            amount = rng.randint(1000, 100000)
+        sources.append({
+            'source': 'txo:sov:{:08}'.format(i),
+            'paymentAddress': 'pay:sov:benchmark',
+            'amount': amount,
+            'extra': None
+        })
+    return sources
+
+
+def make_amounts(sources, count, rng):
+    total = total_amount(sources)
+    return [rng.randint(1, max(1, total // 20)) for _ in range(count)]
+
+
+def is_valid(selected, amount):
+    ids = [source['source'] for source in selected]
+    return len(ids) == len(set(ids)) and total_amount(selected) >= amount
+
+
+def benchmark(sources, amounts, strategy):
+    seconds = 0.0
+    inputs = 0
+    change = 0
+    exact = 0
+    failed = 0
+    valid = True
+    for amount in amounts:
+        begin = time.perf_counter()
+        try:
+            selected = select_sources(sources, amount, strategy)
+        except Exception:
+            failed += 1
+            continue
+        finally:
+            seconds += time.perf_counter() - begin
+        valid = valid and is_valid(selected, amount)
+        inputs += len(selected)
+        change += total_amount(selected) - amount
+        exact += total_amount(selected) == amount
+    selections = len(amounts) - failed
+    return seconds, inputs / max(selections, 1), change / max(selections, 1), exact, failed, valid
+
+
+def main():
+    args = parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+    rng = random.Random(args.seed)
+
+    print('{:>8} {:<15} {:>12} {:>12} {:>14} {:>8} {:>8} {:>8}'.format(
+        'sources', 'strategy', 'time (ms)', 'avg inputs', 'avg change', 'exact', 'failed', 'valid'))
+    all_valid = True
+    for size in sizes:
+        sources = make_sources(size, rng)
+        amounts = make_amounts(sources, args.payments, rng)
+        for strategy in STRATEGIES:
+            seconds, inputs, change, exact, failed, valid = benchmark(sources, amounts, strategy)
+            all_valid = all_valid and valid
+            print('{:>8} {:<15} {:>12.2f} {:>12.1f} {:>14.1f} {:>8} {:>8} {:>8}'.format(
+                size, strategy, seconds * 1000 / len(amounts), inputs, change, exact, failed, str(valid)))
+
+        begin = time.perf_counter()
+        batches = plan_consolidation(sources, 'pay:sov:benchmark', MAX_INPUTS_PER_TRANSACTION)
+        seconds = time.perf_counter() - begin
+        merged = sum(len(batch['inputs']) for batch in batches)
+        print('{:>8} {:<15} {:>12.2f} merges {} sources into {} by as many transactions'.format(
+            size, 'consolidation', seconds * 1000, merged, len(batches)))
+
+    if not all_valid:
+        raise SystemExit('A strategy returned an invalid selection')
+
+
+if __name__ == '__main__':
+    main()
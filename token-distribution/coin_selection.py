@@ -0,0 +1,151 @@
+# Selection of payment sources (UTXOs) to spend for a payment.
+#
+# A source is a dict as returned by get_payment_sources:
+#   {'source': 'txo:sov:...', 'paymentAddress': ..., 'amount': 10, 'extra': ...}
+#
+# Every strategy returns the list of chosen sources, or raises when the
+# sources cannot cover the amount. Fewer inputs make a smaller (and cheaper)
+# transaction, and an exact match needs no change output at all.
+
+LEDGER_ORDER = 'ledger'
+LARGEST_FIRST = 'largest-first'
+EXACT_MATCH = 'exact-match'
+MIN_INPUTS = 'min-inputs'
+AUTO = 'auto'
+
+STRATEGIES = [AUTO, EXACT_MATCH, MIN_INPUTS, LARGEST_FIRST, LEDGER_ORDER]
+
+# Number of branches the exact match search may visit before giving up
+MAX_TRIES = 100000
+
+
+def total_amount(sources) -> int:
+    return sum(source['amount'] for source in sources)
+
+
+def check_funds(sources, amount):
+    available = total_amount(sources)
+    if available < amount:
+        raise Exception('Insufficient funds on inputs: required: {}, source: {}'.format(amount, available))
+
+
+def select_ledger_order(sources, amount) -> list:
+    # Takes sources in the order the ledger returned them until there is enough
+    check_funds(sources, amount)
+    selected = []
+    selected_amount = 0
+    for source in sources:
+        if selected_amount >= amount:
+            break
+        selected.append(source)
+        selected_amount += source['amount']
+    return selected
+
+
+def select_largest_first(sources, amount) -> list:
+    return select_ledger_order(sorted(sources, key=lambda source: -source['amount']), amount)
+
+
+def select_min_inputs(sources, amount) -> list:
+    # The largest sources give the fewest inputs. The last of them is then
+    # swapped for the smallest source that still covers the rest, which keeps
+    # the input count and makes the change as small as possible.
+    largest = select_largest_first(sources, amount)
+    if not largest:
+        return largest
+    chosen = largest[:-1]
+    missing = amount - total_amount(chosen)
+    chosen_ids = {source['source'] for source in chosen}
+    closing = min((source for source in sources
+                   if source['source'] not in chosen_ids and source['amount'] >= missing),
+                  key=lambda source: source['amount'])
+    return chosen + [closing]
+
+
+def select_exact_match(sources, amount, max_tries=MAX_TRIES) -> list:
+    # Depth first branch and bound search for sources adding up to exactly
+    # 'amount', trying large sources first. Returns None when there is no
+    # exact match or none was found within 'max_tries' branches.
+    check_funds(sources, amount)
+    if amount == 0:
+        return []
+    ordered = sorted(sources, key=lambda source: -source['amount'])
+    # remaining[i] is the sum of ordered[i:], the most the rest can add
+    remaining = [0] * (len(ordered) + 1)
+    for i in range(len(ordered) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + ordered[i]['amount']
+
+    tries = 0
+    chosen = []
+    # stack of (next index to decide, sum so far, number of chosen sources)
+    stack = [(0, 0, 0)]
+    while stack:
+        tries += 1
+        if tries > max_tries:
+            return None
+        index, selected_amount, depth = stack.pop()
+        del chosen[depth:]
+        if selected_amount == amount:
+            return [ordered[i] for i in chosen]
+        if index == len(ordered) or selected_amount + remaining[index] < amount:
+            continue
+        # skipping ordered[index] is tried after taking it; equal amounts
+        # after a skipped source would only repeat the same sums
+        skip = index + 1
+        while skip < len(ordered) and ordered[skip]['amount'] == ordered[index]['amount']:
+            skip += 1
+        stack.append((skip, selected_amount, depth))
+        if selected_amount + ordered[index]['amount'] <= amount:
+            chosen.append(index)
+            stack.append((index + 1, selected_amount + ordered[index]['amount'], depth + 1))
+    return None
+
+
+def select_sources(sources, amount, strategy=AUTO) -> list:
+    if strategy == LEDGER_ORDER:
+        return select_ledger_order(sources, amount)
+    if strategy == LARGEST_FIRST:
+        return select_largest_first(sources, amount)
+    if strategy == MIN_INPUTS:
+        return select_min_inputs(sources, amount)
+    if strategy == EXACT_MATCH:
+        selected = select_exact_match(sources, amount)
+        if selected is None:
+            raise Exception('No combination of sources adds up to exactly {}'.format(amount))
+        return selected
+    if strategy == AUTO:
+        # An exact match saves the change output, but only if it does not
+        # need more inputs than the change would have cost
+        fewest = select_min_inputs(sources, amount)
+        if total_amount(fewest) == amount:
+            return fewest
+        exact = select_exact_match(sources, amount)
+        if exact is not None and len(exact) <= len(fewest) + 1:
+            return exact
+        return fewest
+    raise Exception('Unknown coin selection strategy: {}'.format(strategy))
+
+
+def plan_consolidation(sources, payment_address, max_inputs, min_sources=2, below=None) -> list:
+    # Merges the sources smaller than 'below' (all of them if not set),
+    # smallest first, into one output per transaction, paid back to
+    # 'payment_address'. Each batch spends at most 'max_inputs' sources.
+    # Returns a list of batches {'inputs', 'outputs'}; batches of fewer than
+    # 'min_sources' sources are left out, as merging them gains nothing.
+    if max_inputs < 2:
+        raise Exception('A consolidation transaction needs at least 2 inputs')
+    ordered = sorted((source for source in sources if below is None or source['amount'] < below),
+                     key=lambda source: source['amount'])
+    batches = []
+    for start in range(0, len(ordered), max_inputs):
+        batch_sources = ordered[start:start + max_inputs]
+        if len(batch_sources) < max(min_sources, 2):
+            continue
+        batches.append({
+            'inputs': [source['source'] for source in batch_sources],
+            'outputs': [{
+                'recipient': payment_address,
+                'amount': total_amount(batch_sources)
+            }]
+        })
+    return batches
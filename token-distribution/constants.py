@@ -2,3 +2,12 @@ PAYMENT_METHOD = 'sov'
 POOL_NAME = 'pool1'
 LIBRARY = {"darwin": "libsovtoken.dylib", "linux": "libsovtoken.so", "win32": "sovtoken.dll", 'windows': 'sovtoken.dll'}
 PROTOCOL_VERSION = 2
+# Keeps each payment request well below the pool's message size limit
+DEFAULT_BATCH_SIZE = 100
+MAX_INPUTS_PER_TRANSACTION = 100
+DEFAULT_CONCURRENCY = 4
+# Receipt verification: requests in flight, retries after a pool timeout and
+# the delay before the first retry (doubled for every further one), in seconds
+VERIFY_CONCURRENCY = 10
+VERIFY_RETRIES = 3
+VERIFY_BACKOFF = 1.0
@@ -0,0 +1,189 @@
+# Check of the email dispatcher against a local stand-in SMTP server. The
+# server accepts every message, but refuses recipients containing 'refused'
+# (550), greylists the first message to a recipient containing 'greylisted'
+# (451) and drops the connection the first time a message to a recipient
+# containing 'flaky' comes in. Then
+#   - sends a batch and checks that it kept to the rate limit: n attempts at
+#     'rate' per second take at least (n - 1) / rate seconds
+#   - checks that every message arrived once, the dropped and greylisted ones
+#     being retried and the refused one failing without a retry
+#   - sends the same batch again with the same send log, as a resumed publish
+#     does, and checks that only the refused recipient is tried again
+# No mail account or network access is needed.
+#
+# Run with: python3 email_check.py [--messages 20] [--rate 10] [--connections 2]
+
+import argparse
+import os
+import socketserver
+import tempfile
+import threading
+import time
+
+from email_dispatcher import EmailDispatcher, SENT, SKIPPED, FAILED
+
+SUBJECT = 'Token distribution'
+REFUSED = 'refused'
+GREYLISTED = 'greylisted'
+FLAKY = 'flaky'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20, help='number of messages to send (at least 4)')
+    parser.add_argument('--rate', type=float, default=10.0, help='messages per second over all connections')
+    parser.add_argument('--connections', type=int, default=2, help='number of SMTP connections')
+    return parser.parse_args()
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    # Speaks just enough SMTP for smtplib, without authentication or TLS
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        self.reply('220 stand-in SMTP server')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == 'RCPT':
+                recipient = command.split(':', 1)[1].strip(' <>')
+                if REFUSED in recipient:
+                    self.reply('550 no such user')
+                elif GREYLISTED in recipient and self.server.greylist(recipient):
+                    self.reply('451 greylisted, try again later')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                if not self.server.accept(recipients):
+                    return
+                recipients = []
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                if verb in ('MAIL', 'RSET'):
+                    recipients = []
+                self.reply('250 ok')
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInSMTPHandler)
+        self.lock = threading.Lock()
+        # recipient: number of messages accepted for it
+        self.received = {}
+        self.dropped = set()
+        self.greylisted = set()
+
+    def greylist(self, recipient) -> bool:
+        # True the first time 'recipient' is seen
+        with self.lock:
+            if recipient in self.greylisted:
+                return False
+            self.greylisted.add(recipient)
+            return True
+
+    def accept(self, recipients) -> bool:
+        # Returns False if the connection is to be dropped instead
+        with self.lock:
+            flaky = [recipient for recipient in recipients if FLAKY in recipient and recipient not in self.dropped]
+            if flaky:
+                self.dropped.update(flaky)
+                return False
+            for recipient in recipients:
+                self.received[recipient] = self.received.get(recipient, 0) + 1
+            return True
+
+
+def make_targets(count):
+    targets = [{'to': 'recipient{}@example.com'.format(i), 'body': 'You have received {} tokens'.format(i)}
+               for i in range(count)]
+    targets[1]['to'] = FLAKY + '@example.com'
+    targets[2]['to'] = REFUSED + '@example.com'
+    targets[3]['to'] = GREYLISTED + '@example.com'
+    return targets
+
+
+def send(server, targets, log_path, args):
+    # Returns the seconds taken and the status of every recipient
+    host, port = server.server_address
+    dispatcher = EmailDispatcher('sender@example.com', None, host, port, use_ssl=False,
+                                 connections=args.connections, rate=args.rate, log_path=log_path)
+    begin = time.perf_counter()
+    results = dispatcher.send_all(targets, SUBJECT)
+    return time.perf_counter() - begin, {to: status for to, status, _ in results}
+
+
+def report(name, seconds, statuses, problems):
+    counts = [sum(status == expected for status in statuses.values()) for expected in (SENT, SKIPPED, FAILED)]
+    print('{:<8} {:>8} {:>8} {:>8} {:>8} {:>12.3f} {:>8}'.format(
+        name, len(statuses), *counts, seconds, str(not problems)))
+
+
+def main():
+    args = parse_args()
+    if args.messages < 4:
+        raise SystemExit('--messages must be at least 4')
+    targets = make_targets(args.messages)
+    refused = targets[2]['to']
+
+    server = StandInSMTPServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    problems = []
+
+    print('{:<8} {:>8} {:>8} {:>8} {:>8} {:>12} {:>8}'.format(
+        'run', 'messages', 'sent', 'skipped', 'failed', 'seconds', 'correct'))
+    try:
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_path = os.path.join(log_dir, 'send-log.jsonl')
+
+            seconds, statuses = send(server, targets, log_path, args)
+            first_problems = []
+            expected = {target['to']: FAILED if target['to'] == refused else SENT for target in targets}
+            if statuses != expected:
+                first_problems.append('first run: unexpected statuses {}'.format(
+                    {to: status for to, status in statuses.items() if expected[to] != status}))
+            # one attempt per message plus the retries of the dropped and the
+            # greylisted one
+            attempts = len(targets) + 2
+            if seconds < (attempts - 1) / args.rate:
+                first_problems.append('first run: {} attempts took {:.3f}s, less than the rate limit allows'.format(
+                    attempts, seconds))
+            received = dict(server.received)
+            if received != {to: 1 for to, status in expected.items() if status == SENT}:
+                first_problems.append('first run: messages received per recipient: {}'.format(received))
+            report('first', seconds, statuses, first_problems)
+
+            seconds, statuses = send(server, targets, log_path, args)
+            resume_problems = []
+            expected = {target['to']: FAILED if target['to'] == refused else SKIPPED for target in targets}
+            if statuses != expected:
+                resume_problems.append('resumed run: unexpected statuses {}'.format(
+                    {to: status for to, status in statuses.items() if expected[to] != status}))
+            if server.received != received:
+                resume_problems.append('resumed run: messages in the send log were sent again')
+            report('resumed', seconds, statuses, resume_problems)
+            problems = first_problems + resume_problems
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if problems:
+        raise SystemExit('\n'.join(problems))
+
+
+if __name__ == '__main__':
+    main()
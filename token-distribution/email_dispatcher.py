@@ -0,0 +1,200 @@
+import hashlib
+import json
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+DEFAULT_HOST = 'smtp.gmail.com'
+DEFAULT_PORT = 465
+DEFAULT_CONNECTIONS = 2
+# Messages per second over all connections
+DEFAULT_RATE = 5.0
+DEFAULT_RETRIES = 2
+
+SENT = 'sent'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+def is_permanent_error(err) -> bool:
+    # A refused sender, recipient or message is permanent only with a 5xx
+    # reply; sending it again will not help. 4xx replies (greylisting, rate
+    # limits, a server closing down) are retried like any other error.
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in err.recipients.values()]
+    elif isinstance(err, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        codes = [err.smtp_code]
+    else:
+        return False
+    return bool(codes) and all(500 <= code < 600 for code in codes)
+
+
+def message_key(to, subject, body):
+    return hashlib.sha256('\n'.join([to, subject, body]).encode()).hexdigest()
+
+
+class RateLimiter:
+    # Spaces calls evenly, 'rate' per second over all threads
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class SendLog:
+    # JSON lines file recording every message sent. Messages found in it as
+    # sent are skipped, so a re-run only mails the recipients not yet notified.
+
+    def __init__(self, path):
+        self.sent = set()
+        self.lock = threading.Lock()
+        self.file = None
+        if path is None:
+            return
+        try:
+            with open(path) as log_file:
+                for line in log_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of an interrupted run may be cut off
+                        continue
+                    if entry.get('status') == SENT:
+                        self.sent.add(entry['key'])
+        except FileNotFoundError:
+            pass
+        self.file = open(path, 'a')
+
+    def is_sent(self, key):
+        return key in self.sent
+
+    def record(self, key, to, status, error=None):
+        with self.lock:
+            if status == SENT:
+                self.sent.add(key)
+            if self.file is not None:
+                self.file.write(json.dumps({'key': key, 'to': to, 'status': status, 'error': error,
+                                            'time': time.time()}) + '\n')
+                self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class EmailDispatcher:
+    # Sends messages over a small pool of SMTP connections, one per worker
+    # thread. A connection that fails is dropped and opened again for the
+    # next attempt.
+
+    def __init__(self, sender, password, host=DEFAULT_HOST, port=DEFAULT_PORT, use_ssl=True,
+                 connections=DEFAULT_CONNECTIONS, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES, log_path=None):
+        self.sender = sender
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.connections = connections
+        self.retries = retries
+        self.rate_limiter = RateLimiter(rate)
+        self.send_log = SendLog(log_path)
+        self.local = threading.local()
+        self.servers = []
+        self.servers_lock = threading.Lock()
+
+    def connect(self):
+        server = smtplib.SMTP_SSL(self.host, self.port) if self.use_ssl else smtplib.SMTP(self.host, self.port)
+        server.ehlo()
+        if self.password:
+            server.login(self.sender, self.password)
+        return server
+
+    def connection(self):
+        server = getattr(self.local, 'server', None)
+        if server is None:
+            server = self.connect()
+            self.local.server = server
+            with self.servers_lock:
+                self.servers.append(server)
+        return server
+
+    def drop_connection(self):
+        server = getattr(self.local, 'server', None)
+        self.local.server = None
+        if server is None:
+            return
+        with self.servers_lock:
+            self.servers.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def build_message(self, to, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    def send(self, target, subject):
+        # 'target' is a dict with 'to' and 'body'. Returns (to, status, error)
+        to = target['to']
+        key = message_key(to, subject, target['body'])
+        if self.send_log.is_sent(key):
+            return to, SKIPPED, None
+
+        message = self.build_message(to, subject, target['body'])
+        error = None
+        for _ in range(self.retries + 1):
+            self.rate_limiter.wait()
+            try:
+                self.connection().send_message(message)
+            except smtplib.SMTPAuthenticationError:
+                raise
+            except (smtplib.SMTPException, OSError) as err:
+                error = str(err)
+                if is_permanent_error(err):
+                    break
+                self.drop_connection()
+                continue
+            self.send_log.record(key, to, SENT)
+            return to, SENT, None
+
+        self.send_log.record(key, to, FAILED, error)
+        return to, FAILED, error
+
+    def send_all(self, targets, subject, on_result=None):
+        # Sends to every target and returns the list of (to, status, error).
+        # 'on_result' is called with each of them as soon as it is known.
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as executor:
+                for result in executor.map(lambda target: self.send(target, subject), targets):
+                    if on_result is not None:
+                        on_result(*result)
+                    results.append(result)
+        finally:
+            self.close()
+        return results
+
+    def close(self):
+        with self.servers_lock:
+            servers, self.servers = self.servers, []
+        for server in servers:
+            try:
+                server.quit()
+            except Exception:
+                pass
+        self.send_log.close()
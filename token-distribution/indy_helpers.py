@@ -1,13 +1,14 @@
+import asyncio
 import json
 from getpass import getpass
 
 from indy.error import IndyError, ErrorCode
 from indy import wallet, ledger, payment, pool
-from constants import PAYMENT_METHOD, POOL_NAME, PROTOCOL_VERSION
-from utils import run_coroutine, run_array
+from constants import PAYMENT_METHOD, POOL_NAME, PROTOCOL_VERSION, VERIFY_CONCURRENCY, VERIFY_RETRIES, VERIFY_BACKOFF
+from utils import run_coroutine
 
 
-def open_wallet(wallet_info) -> int:
+def open_wallet(wallet_info, key=None) -> int:
     wallet_config = {
         'id': wallet_info['walletId'],
         'storage_config': {
@@ -15,7 +16,8 @@ def open_wallet(wallet_info) -> int:
         }
     }
 
-    key = getpass("Enter Key for Wallet \"{}\":   ".format(wallet_config['id']))
+    if key is None:
+        key = getpass("Enter Key for Wallet \"{}\":   ".format(wallet_config['id']))
 
     wallet_credentials = {
         'key': key
@@ -42,8 +44,9 @@ def close_wallet(wallet_handle):
         raise Exception(err.message)
 
 
-def open_pool() -> int:
-    genesis_transactions = input("Enter path to Pool Genesis Transactions file:     ")
+def open_pool(genesis_transactions=None) -> int:
+    if genesis_transactions is None:
+        genesis_transactions = input("Enter path to Pool Genesis Transactions file:     ")
     config = {'genesis_txn': genesis_transactions}
 
     try:
@@ -86,19 +89,54 @@ async def close_and_delete_pool(pool_handle):
 
 def send_transaction(pool_handle: int, transaction: str) -> str:
     try:
-        response = json.loads(
-            run_coroutine(ledger.submit_request(pool_handle, transaction)))
+        return parse_transaction_response(run_coroutine(ledger.submit_request(pool_handle, transaction)))
+    except IndyError as err:
+        handle_transaction_error(err)
 
-        if response['op'] != 'REPLY':
-            raise Exception(response['reason'])
 
-        return json.dumps(response)
-    except IndyError as err:
-        if err.error_code == ErrorCode.CommonInvalidStructure:
-            raise Exception('Invalid Transaction')
-        if err.error_code == ErrorCode.PoolLedgerTimeout:
-            raise Exception('Cannot get response from Ledger')
-        raise Exception(err.message)
+async def submit_transaction(pool_handle: int, transaction: str, semaphore) -> str:
+    async with semaphore:
+        try:
+            return parse_transaction_response(await ledger.submit_request(pool_handle, transaction))
+        except IndyError as err:
+            handle_transaction_error(err)
+
+
+def send_transactions(pool_handle: int, transactions: list, concurrency: int, on_result=None) -> list:
+    # At most 'concurrency' requests are in flight. The result of every
+    # transaction is either its response or the Exception it failed with,
+    # so one failed transaction does not hide the others. 'on_result' is
+    # called with the index and result of each transaction as soon as it is known.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def submit(index, transaction):
+        try:
+            result = await submit_transaction(pool_handle, transaction, semaphore)
+        except Exception as err:
+            result = err
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    return run_coroutine(asyncio.gather(
+        *[submit(index, transaction) for index, transaction in enumerate(transactions)]))
+
+
+def parse_transaction_response(response: str) -> str:
+    response = json.loads(response)
+
+    if response['op'] != 'REPLY':
+        raise Exception(response['reason'])
+
+    return json.dumps(response)
+
+
+def handle_transaction_error(err: IndyError):
+    if err.error_code == ErrorCode.CommonInvalidStructure:
+        raise Exception('Invalid Transaction')
+    if err.error_code == ErrorCode.PoolLedgerTimeout:
+        raise Exception('Cannot get response from Ledger')
+    raise Exception(err.message)
 
 
 def get_payment_sources(pool_handle: int, payment_address: str):
@@ -116,23 +154,53 @@ def get_payment_sources(pool_handle: int, payment_address: str):
         handle_payment_error(err)
 
 
-def verify_payment_on_ledger(pool_handle, receipts):
-    try:
-        requests = run_array(
-            [payment.build_verify_payment_req(-1, None, receipt) for receipt in receipts])
-
-        responses = run_array(
-            [ledger.submit_request(pool_handle, list(request.result())[0]) for request in requests[0]])
-
-        results = run_array(
-            [payment.parse_verify_payment_response(PAYMENT_METHOD, response.result()) for response in responses[0]])
-
-        for receipt in [result.result() for result in results[0]]:
-            if len(json.loads(receipt)['sources']) == 0:
-                raise Exception('Payment failed')
-        return
-    except IndyError as err:
-        handle_payment_error(err)
+RECEIPT_VERIFIED = 'verified'
+RECEIPT_NOT_FOUND = 'not found'
+RECEIPT_ERROR = 'error'
+
+
+async def verify_receipt(pool_handle, receipt, semaphore, retries, backoff) -> dict:
+    # A pool timeout is retried after 'backoff' seconds, doubling the delay
+    # every time. The semaphore is not held while waiting. Any other failure
+    # is returned as the result of this receipt, so that it does not abort
+    # the verification of the others.
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with semaphore:
+                request, _ = await payment.build_verify_payment_req(-1, None, receipt)
+                response = await ledger.submit_request(pool_handle, request)
+                result = json.loads(await payment.parse_verify_payment_response(PAYMENT_METHOD, response))
+            status = RECEIPT_VERIFIED if len(result['sources']) > 0 else RECEIPT_NOT_FOUND
+        except IndyError as err:
+            if err.error_code == ErrorCode.PoolLedgerTimeout and attempt <= retries:
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+                continue
+            return {'receipt': receipt, 'status': RECEIPT_ERROR, 'attempts': attempt, 'error': err.message}
+        except Exception as err:
+            return {'receipt': receipt, 'status': RECEIPT_ERROR, 'attempts': attempt,
+                    'error': '{}: {}'.format(type(err).__name__, err)}
+
+        return {'receipt': receipt, 'status': status, 'attempts': attempt, 'error': ''}
+
+
+def verify_payments(pool_handle, receipts, concurrency=VERIFY_CONCURRENCY, retries=VERIFY_RETRIES,
+                    backoff=VERIFY_BACKOFF, on_result=None) -> list:
+    # Verifies every receipt with at most 'concurrency' requests in flight.
+    # 'on_result' is called with each result as soon as it is known.
+    async def verify_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        results = []
+        for pending in asyncio.as_completed(
+                [verify_receipt(pool_handle, receipt, semaphore, retries, backoff) for receipt in receipts]):
+            result = await pending
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        return results
+
+    return run_coroutine(verify_all())
 
 
 def build_payment_request(wallet_handle, inputs, outputs):
@@ -0,0 +1,119 @@
+import csv
+import hashlib
+
+from constants import PAYMENT_METHOD
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_VALUES = {char: value for value, char in enumerate(BASE58_ALPHABET)}
+
+# A payment address encodes a 32 byte verkey followed by a 4 byte checksum,
+# the start of the double SHA-256 of the verkey (base58check, as in sovtoken)
+ADDRESS_BYTES = 36
+CHECKSUM_BYTES = 4
+ADDRESS_PREFIX = 'pay:{}:'.format(PAYMENT_METHOD)
+
+TARGET_COLUMNS = 4
+
+
+def base58_decode(text):
+    # Bytes 'text' decodes to, or None if it is not base58
+    number = 0
+    for char in text:
+        value = BASE58_VALUES.get(char)
+        if value is None:
+            return None
+        number = number * 58 + value
+    leading_zeros = len(text) - len(text.lstrip('1'))
+    return bytes(leading_zeros) + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+
+
+def address_checksum(verkey: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(verkey).digest()).digest()[:CHECKSUM_BYTES]
+
+
+def payment_address_error(address):
+    if not address.startswith(ADDRESS_PREFIX):
+        return "invalid payment address '{}': it must start with '{}'".format(address, ADDRESS_PREFIX)
+    decoded = base58_decode(address[len(ADDRESS_PREFIX):])
+    if decoded is None:
+        return "invalid payment address '{}': it is not base58".format(address)
+    if len(decoded) != ADDRESS_BYTES:
+        return "invalid payment address '{}': it encodes {} bytes instead of {}".format(
+            address, len(decoded), ADDRESS_BYTES)
+    verkey, checksum = decoded[:-CHECKSUM_BYTES], decoded[-CHECKSUM_BYTES:]
+    if checksum != address_checksum(verkey):
+        return "invalid payment address '{}': bad checksum".format(address)
+    return None
+
+
+def amount_error(amount):
+    if not (amount.isascii() and amount.isdigit()) or int(amount) <= 0:
+        return "invalid tokens amount '{}': it must be a positive integer".format(amount)
+    return None
+
+
+def validate_input_file(path, allow_duplicates=False):
+    # Reads and checks the input CSV file row by row. Returns
+    # (sender info, targets, errors) where every error is a message starting
+    # with its line number, so all problems are reported in one pass.
+    errors = []
+    source = None
+    targets = []
+    # payment address -> line of its first target
+    first_lines = {}
+
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        for row in reader:
+            line = reader.line_num
+            row = [value.strip() for value in row]
+            if not any(row):
+                continue
+
+            if source is None:
+                if len(row) < 3:
+                    errors.append('Line {}: expected payment address, wallet id and wallet path'.format(line))
+                    row = row + [''] * (3 - len(row))
+                error = payment_address_error(row[0])
+                if error:
+                    errors.append('Line {}: {}'.format(line, error))
+                if not row[1]:
+                    errors.append('Line {}: wallet id is empty'.format(line))
+                source = {
+                    'paymentAddress': row[0],
+                    'walletId': row[1],
+                    'walletPath': row[2]
+                }
+                continue
+
+            if len(row) != TARGET_COLUMNS:
+                errors.append('Line {}: expected {} columns (legal name, tokens amount, payment address, email), '
+                              'found {}'.format(line, TARGET_COLUMNS, len(row)))
+                continue
+
+            legal_name, amount, address, email = row
+            row_errors = [amount_error(amount), payment_address_error(address)]
+            if email and '@' not in email:
+                row_errors.append("invalid email address '{}'".format(email))
+            if not allow_duplicates and address in first_lines:
+                row_errors.append("payment address '{}' is already paid on line {}".format(address, first_lines[address]))
+            first_lines.setdefault(address, line)
+
+            row_errors = [error for error in row_errors if error]
+            if row_errors:
+                errors.extend('Line {}: {}'.format(line, error) for error in row_errors)
+                continue
+
+            targets.append({
+                'legalName': legal_name,
+                'tokensAmount': amount,
+                'paymentAddress': address,
+                'email': email
+            })
+
+    if source is None:
+        errors.append('File is empty')
+    elif not targets and not errors:
+        errors.append('There is no any target payment in the document')
+
+    return source, targets, errors
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import time
+
+# Events recorded for every payment transaction (batch) during publish
+SUBMITTING = 'submitting'
+SUBMITTED = 'submitted'
+SEND_FAILED = 'send failed'
+VERIFIED = 'verified'
+STARTED = 'started'
+
+
+def data_digest(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class Journal:
+    # Write-ahead journal of the publish phase, one JSON object per line.
+    # Every entry is flushed to disk before the step it records goes on, so
+    # after a crash the journal tells which transactions were sent, what the
+    # ledger replied and which were verified.
+
+    def __init__(self, path, digest):
+        self.path = path
+        self.entries = []
+        try:
+            with open(path) as journal_file:
+                for line in journal_file:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        # the last line of an interrupted run may be cut off
+                        continue
+        except FileNotFoundError:
+            pass
+
+        started = [entry for entry in self.entries if entry['event'] == STARTED]
+        if started and started[0]['digest'] != digest:
+            raise Exception('Journal "{}" belongs to a different result archive'.format(path))
+
+        self.file = open(path, 'a')
+        self.record(STARTED, digest=digest)
+
+    def record(self, event, **fields):
+        entry = dict(fields, event=event, time=time.time())
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.entries.append(entry)
+
+    def batch_states(self) -> dict:
+        # Returns batch index -> the latest entry of every event for that batch
+        states = {}
+        for entry in self.entries:
+            if 'batch' in entry:
+                states.setdefault(entry['batch'], {})[entry['event']] = entry
+        return states
+
+    def close(self):
+        self.file.close()
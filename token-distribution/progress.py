@@ -0,0 +1,35 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class Progress:
+    # Machine readable progress output: one JSON object per line with the
+    # event name, the time and the seconds elapsed since the start. Nothing
+    # is written until a stream is set (--json).
+
+    def __init__(self):
+        self.stream = None
+        self.begin = time.perf_counter()
+
+    def enable(self, stream):
+        self.stream = stream
+        self.begin = time.perf_counter()
+
+    def emit(self, event, **fields):
+        if self.stream is None:
+            return
+        entry = dict(fields, event=event, time=time.time(), elapsed=round(time.perf_counter() - self.begin, 3))
+        self.stream.write(json.dumps(entry) + '\n')
+        self.stream.flush()
+
+    @contextmanager
+    def phase(self, name):
+        # Emits 'phase started' and 'phase finished' with its duration
+        self.emit('phase started', phase=name)
+        begin = time.perf_counter()
+        yield
+        self.emit('phase finished', phase=name, seconds=round(time.perf_counter() - begin, 3))
+
+
+progress = Progress()
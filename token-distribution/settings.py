@@ -0,0 +1,93 @@
+import json
+import os
+import re
+
+ENV_PREFIX = 'TOKEN_DISTRIBUTION_'
+
+# Settings only taken from the environment or the config file: on the command
+# line they would be visible to every user of the machine
+SECRETS = ['walletKey', 'emailPassword']
+
+TRUE_VALUES = ['1', 'true', 'yes', 'y']
+FALSE_VALUES = ['0', 'false', 'no', 'n', '']
+
+
+def env_name(name):
+    # 'genesisFile' -> 'TOKEN_DISTRIBUTION_GENESIS_FILE'
+    return ENV_PREFIX + re.sub('([A-Z])', r'_\1', name).upper()
+
+
+def read_config(path) -> dict:
+    try:
+        with open(path) as config_file:
+            config = json.load(config_file)
+    except FileNotFoundError:
+        raise Exception('Config file "{}" not found'.format(path))
+    except ValueError as err:
+        raise Exception('Config file "{}" is not valid JSON: {}'.format(path, err))
+    if not isinstance(config, dict):
+        raise Exception('Config file "{}" must hold a JSON object'.format(path))
+    return config
+
+
+def parse_flag(name, value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in TRUE_VALUES:
+        return True
+    if str(value).lower() in FALSE_VALUES:
+        return False
+    raise Exception('Invalid value "{}" for {}: expected true or false'.format(value, name))
+
+
+def parse_settings(parser, argv=None):
+    # Parses the command line, taking every option not given there from the
+    # environment (TOKEN_DISTRIBUTION_<OPTION>) or else from the JSON config
+    # file named by --config, whose keys are the option names. Secrets are
+    # added to the result the same way, without a command line option.
+    known, _ = parser.parse_known_args(argv)
+    config = read_config(known.config) if known.config else {}
+
+    options = {action.dest: action for action in parser._actions if action.option_strings and action.dest != 'help'}
+
+    unknown = [name for name in config if name not in options and name not in SECRETS]
+    if unknown:
+        raise Exception('Unknown setting(s) in config file "{}": {}'.format(known.config, ', '.join(unknown)))
+
+    defaults = {}
+    for name in list(options) + SECRETS:
+        if env_name(name) in os.environ:
+            value = os.environ[env_name(name)]
+        elif name in config:
+            value = config[name]
+        else:
+            continue
+
+        action = options.get(name)
+        if action is not None and action.nargs == 0:
+            value = parse_flag(name, value)
+        elif action is not None and action.choices and value not in action.choices:
+            raise Exception('Invalid value "{}" for {}: expected one of {}'.format(value, name,
+                                                                                 ', '.join(action.choices)))
+        defaults[name] = value
+
+    parser.set_defaults(**{name: value for name, value in defaults.items() if name in options})
+    args = parser.parse_args(argv)
+
+    for name in SECRETS:
+        setattr(args, name, defaults.get(name))
+
+    return args
+
+
+def get_input(args, name):
+    # Value of a setting the script asks the user for when it is missing.
+    # Returns None to have the user asked, unless in non-interactive mode
+    # where a missing setting is an error.
+    value = getattr(args, name)
+    if value is None and args.nonInteractive:
+        sources = [env_name(name), '"{}" in the config file'.format(name)]
+        if name not in SECRETS:
+            sources.insert(0, '--{}'.format(name))
+        raise Exception('No {} given in non-interactive mode. Set it with {}'.format(name, ' or '.join(sources)))
+    return value
@@ -0,0 +1,369 @@
+# Dry-run backend for token-distribution. Payment sources, payment requests
+# and receipts are simulated over an in-memory UTXO set, so the prepare, build
+# and publish phases run without a pool, a wallet or real tokens.
+#
+# The functions below have the same signatures as their namesakes in
+# indy_helpers; install() puts them in place of those. Between the separate
+# runs of the phases, the simulated ledger is kept in a JSON file.
+#
+#   python3 simulator.py ledger.json mint pay:sov:... 1000000 --sources 500
+#   python3 token-distribution.py prepare --dataFile=data.csv --simulate=ledger.json
+#   python3 simulator.py ledger.json balance pay:sov:...
+#
+#   python3 simulator.py ledger.json run --recipients 10000
+# runs all phases on generated data in one process and reports their timings.
+
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import random
+import tempfile
+import time
+import types
+
+from constants import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, PAYMENT_METHOD, VERIFY_CONCURRENCY, \
+    VERIFY_RETRIES, VERIFY_BACKOFF
+from input_validation import ADDRESS_BYTES, ADDRESS_PREFIX, BASE58_ALPHABET, CHECKSUM_BYTES, address_checksum
+from utils import run_coroutine
+
+POOL_HANDLE = -100
+WALLET_HANDLE = -200
+
+# Simulated round trip of one request to the pool, in seconds
+latency = 0.0
+ledger = None
+
+
+class SimulatedLedger:
+    # UTXO set of the payment ledger. A source (and a receipt, which is the
+    # source created by a payment) is 'txo:sov:sim:<seqNo>:<output index>'.
+
+    def __init__(self, path=None):
+        self.path = path
+        self.seq_no = 0
+        self.utxos = {}
+        # receipt -> seqNo of the payment that created it
+        self.receipts = {}
+        # seqNo -> payment {'inputs', 'outputs'}
+        self.payments = {}
+        # request digest -> reply, so a request sent twice is answered the
+        # way the pool answers it: with the reply to the original
+        self.replies = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as ledger_file:
+                state = json.load(ledger_file)
+            self.seq_no = state['seqNo']
+            self.utxos = state['utxos']
+            self.receipts = state['receipts']
+            self.payments = {int(seq_no): payment for seq_no, payment in state['payments'].items()}
+            self.replies = state['replies']
+
+    def save(self):
+        if self.path is None:
+            return
+        state = {
+            'seqNo': self.seq_no,
+            'utxos': self.utxos,
+            'receipts': self.receipts,
+            'payments': self.payments,
+            'replies': self.replies
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as ledger_file:
+            json.dump(state, ledger_file)
+        os.replace(tmp, self.path)
+
+    def add_outputs(self, outputs) -> list:
+        self.seq_no += 1
+        created = []
+        for index, output in enumerate(outputs):
+            source = 'txo:{}:sim:{}:{}'.format(PAYMENT_METHOD, self.seq_no, index)
+            self.utxos[source] = {'paymentAddress': output['recipient'], 'amount': output['amount']}
+            self.receipts[source] = self.seq_no
+            created.append({'receipt': source, 'recipient': output['recipient'], 'amount': output['amount'],
+                            'extra': None})
+        return created
+
+    def mint(self, address, amount, sources=1) -> list:
+        # Creates 'amount' tokens on 'address', spread over 'sources' sources
+        amounts = [amount // sources + (1 if index < amount % sources else 0) for index in range(sources)]
+        return self.add_outputs([{'recipient': address, 'amount': part} for part in amounts if part > 0])
+
+    def get_sources(self, address) -> list:
+        return [{'source': source, 'paymentAddress': address, 'amount': utxo['amount'], 'extra': None}
+                for source, utxo in self.utxos.items() if utxo['paymentAddress'] == address]
+
+    def balance(self, address) -> int:
+        return sum(utxo['amount'] for utxo in self.utxos.values() if utxo['paymentAddress'] == address)
+
+    def pay(self, request: str) -> str:
+        digest = hashlib.sha256(request.encode()).hexdigest()
+        if digest in self.replies:
+            return self.replies[digest]
+
+        operation = json.loads(request)['operation']
+        inputs = operation['inputs']
+        outputs = operation['outputs']
+
+        missing = [source for source in inputs if source not in self.utxos]
+        if missing or len(set(inputs)) != len(inputs):
+            return json.dumps({'op': 'REJECT', 'reason': 'Inputs already spent or unknown: {}'.format(missing)})
+        input_amount = sum(self.utxos[source]['amount'] for source in inputs)
+        output_amount = sum(output['amount'] for output in outputs)
+        if input_amount != output_amount or any(output['amount'] <= 0 for output in outputs):
+            return json.dumps({'op': 'REJECT', 'reason': 'Inputs ({}) do not match outputs ({})'.format(
+                input_amount, output_amount)})
+
+        for source in inputs:
+            del self.utxos[source]
+        receipts = self.add_outputs(outputs)
+        self.payments[self.seq_no] = {'inputs': inputs, 'outputs': [receipt['receipt'] for receipt in receipts]}
+
+        reply = json.dumps({'op': 'REPLY', 'result': {'seqNo': self.seq_no, 'receipts': receipts}})
+        self.replies[digest] = reply
+        return reply
+
+    def verify(self, receipt) -> dict:
+        seq_no = self.receipts.get(receipt)
+        if seq_no is None:
+            return {'sources': [], 'receipts': [], 'extra': None}
+        payment = self.payments.get(seq_no, {'inputs': [], 'outputs': [receipt]})
+        # minted sources have no inputs, but do exist on the ledger
+        return {'sources': payment['inputs'] or [receipt], 'receipts': payment['outputs'], 'extra': None}
+
+
+def load_ledger(path):
+    global ledger
+    ledger = SimulatedLedger(path)
+    return ledger
+
+
+async def round_trip(semaphore):
+    if latency:
+        async with semaphore:
+            await asyncio.sleep(latency)
+
+
+# - Backend, in place of indy_helpers - #
+
+def open_pool(genesis_transactions=None) -> int:
+    return POOL_HANDLE
+
+
+def close_pool(pool_handle):
+    ledger.save()
+
+
+def load_payment_plugin():
+    pass
+
+
+def open_wallet(wallet_info, key=None) -> int:
+    return WALLET_HANDLE
+
+
+def close_wallet(wallet_handle):
+    pass
+
+
+def get_payment_sources(pool_handle: int, payment_address: str):
+    return ledger.get_sources(payment_address)
+
+
+def build_payment_request(wallet_handle, inputs, outputs):
+    return json.dumps({'operation': {'type': '10000', 'inputs': inputs, 'outputs': outputs},
+                       'signature': 'simulated'})
+
+
+def send_transactions(pool_handle: int, transactions: list, concurrency: int, on_result=None) -> list:
+    async def submit(index, transaction, semaphore):
+        await round_trip(semaphore)
+        response = json.loads(ledger.pay(transaction))
+        if response['op'] != 'REPLY':
+            result = Exception(response['reason'])
+        else:
+            result = json.dumps(response)
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    async def submit_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[submit(index, transaction, semaphore)
+                                      for index, transaction in enumerate(transactions)])
+
+    results = run_coroutine(submit_all())
+    ledger.save()
+    return results
+
+
+def parse_payment_response(response):
+    return json.loads(response)['result']['receipts']
+
+
+def verify_payments(pool_handle, receipts, concurrency=VERIFY_CONCURRENCY, retries=VERIFY_RETRIES,
+                    backoff=VERIFY_BACKOFF, on_result=None) -> list:
+    async def verify(receipt, semaphore):
+        await round_trip(semaphore)
+        status = 'verified' if ledger.verify(receipt)['sources'] else 'not found'
+        result = {'receipt': receipt, 'status': status, 'attempts': 1, 'error': ''}
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    async def verify_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[verify(receipt, semaphore) for receipt in receipts])
+
+    return run_coroutine(verify_all())
+
+
+BACKEND = ['open_pool', 'close_pool', 'load_payment_plugin', 'open_wallet', 'close_wallet', 'get_payment_sources',
+           'build_payment_request', 'send_transactions', 'parse_payment_response', 'verify_payments']
+
+
+def install(namespace: dict, path=None):
+    # Replaces the indy_helpers functions found in 'namespace' (the globals
+    # of token-distribution.py) by the simulated ones
+    if ledger is None or path is not None:
+        load_ledger(path)
+    namespace.update({name: globals()[name] for name in BACKEND})
+
+
+# - Generated distributions - #
+
+def make_address(rng) -> str:
+    verkey_bits = (ADDRESS_BYTES - CHECKSUM_BYTES) * 8
+    verkey = (rng.getrandbits(verkey_bits) | (1 << (verkey_bits - 1))).to_bytes(verkey_bits // 8, 'big')
+    number = int.from_bytes(verkey + address_checksum(verkey), 'big')
+    encoded = ''
+    while number:
+        number, rest = divmod(number, 58)
+        encoded = BASE58_ALPHABET[rest] + encoded
+    return ADDRESS_PREFIX + encoded
+
+
+def write_distribution(path, sender, recipients, rng) -> int:
+    # Writes an input CSV file paying 'recipients' random addresses. Returns
+    # the number of tokens paid in total.
+    total = 0
+    with open(path, 'w') as data_file:
+        data_file.write('{},simulated,{}\n'.format(sender, os.path.dirname(path)))
+        for index in range(recipients):
+            amount = rng.randint(1, 1000)
+            total += amount
+            data_file.write('Recipient {},{},{},recipient{}@example.com\n'.format(index, amount, make_address(rng),
+                                                                             index))
+    return total
+
+
+def run(args):
+    distribution = importlib.import_module('token-distribution')
+    install(vars(distribution))
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='token-distribution-')
+    data_file = os.path.join(work_dir, 'distribution.csv')
+    timings = []
+
+    sender = make_address(rng)
+    required = write_distribution(data_file, sender, args.recipients, rng)
+    # Change only becomes spendable once published, so every payment
+    # transaction needs its own sources: mint more than is paid out
+    spare = required if args.spare is None else args.spare
+    ledger.mint(sender, required + spare, args.sources)
+
+    begin = time.perf_counter()
+    sender_info, targets = distribution.parse_input_data(data_file)
+    timings.append(('validate', time.perf_counter() - begin))
+
+    begin = time.perf_counter()
+    pool_handle = open_pool()
+    sources = get_payment_sources(pool_handle, sender_info['paymentAddress'])
+    batches = distribution.prepare_payment_batches(sender_info['paymentAddress'], sources, targets,
+                                                   args.batchSize, args.coinSelection)
+    timings.append(('prepare', time.perf_counter() - begin))
+
+    begin = time.perf_counter()
+    wallet_handle = open_wallet(sender_info)
+    signed_batches = [{'transaction': build_payment_request(wallet_handle, batch['inputs'], batch['outputs']),
+                       'targets': batch['targets']} for batch in batches]
+    close_wallet(wallet_handle)
+    timings.append(('build', time.perf_counter() - begin))
+
+    begin = time.perf_counter()
+    publish_args = types.SimpleNamespace(concurrency=args.concurrency, verifyConcurrency=args.verifyConcurrency,
+                                         verifyRetries=VERIFY_RETRIES, dataFile=data_file, verificationFile=None,
+                                         genesisFile=None, nonInteractive=False)
+    journal = distribution.Journal(os.path.join(work_dir, 'distribution-journal.jsonl'), 'simulated')
+    try:
+        statuses = distribution.publish_batches(publish_args, signed_batches, journal)
+    finally:
+        journal.close()
+    timings.append(('publish', time.perf_counter() - begin))
+
+    paid = {}
+    for source in ledger.utxos.values():
+        paid[source['paymentAddress']] = paid.get(source['paymentAddress'], 0) + source['amount']
+    correct = statuses.count(distribution.PAID) == len(batches) \
+        and all(paid.get(target['paymentAddress']) == int(target['tokensAmount']) for target in targets) \
+        and ledger.balance(sender) == spare
+
+    print()
+    print('{} recipients, {} sources, {} payment transactions, results in {}'.format(
+        len(targets), len(sources), len(batches), work_dir))
+    print('{:<10} {:>12}'.format('phase', 'seconds'))
+    for phase, seconds in timings:
+        print('{:<10} {:>12.3f}'.format(phase, seconds))
+    print('{:<10} {:>12.3f}'.format('total', sum(seconds for _, seconds in timings)))
+    print('Ledger balances correct: {}'.format(correct))
+
+    if not correct:
+        raise SystemExit('The simulated distribution did not pay every recipient exactly')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simulated payment ledger for dry runs of token-distribution')
+    parser.add_argument('ledger', help='JSON file holding the simulated ledger')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    mint = subparsers.add_parser('mint', help='Create tokens on a payment address')
+    mint.add_argument('address')
+    mint.add_argument('amount', type=int)
+    mint.add_argument('--sources', type=int, default=1, help='number of sources to spread the tokens over')
+
+    balance = subparsers.add_parser('balance', help='Show the tokens and sources of a payment address')
+    balance.add_argument('address')
+
+    run_parser = subparsers.add_parser('run', help='Run a generated distribution through all phases and time them')
+    run_parser.add_argument('--recipients', type=int, default=10000)
+    run_parser.add_argument('--sources', type=int, default=1000, help='number of sources funding the distribution')
+    run_parser.add_argument('--spare', type=int, default=None,
+                            help='tokens minted on top of the distributed ones (default: as many as are distributed)')
+    run_parser.add_argument('--batchSize', type=int, default=DEFAULT_BATCH_SIZE)
+    run_parser.add_argument('--coinSelection', default='auto')
+    run_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    run_parser.add_argument('--verifyConcurrency', type=int, default=VERIFY_CONCURRENCY)
+    run_parser.add_argument('--latency', type=float, default=0.0,
+                            help='simulated round trip of every request to the pool, in seconds')
+    run_parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    load_ledger(args.ledger)
+    if args.command == 'mint':
+        ledger.mint(args.address, args.amount, args.sources)
+        ledger.save()
+        print('Minted {} tokens on {} in {} source(s)'.format(args.amount, args.address, args.sources))
+    elif args.command == 'balance':
+        sources = ledger.get_sources(args.address)
+        print('{} tokens in {} source(s)'.format(sum(source['amount'] for source in sources), len(sources)))
+    elif args.command == 'run':
+        latency = args.latency
+        run(args)
+        ledger.save()
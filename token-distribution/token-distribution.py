@@ -1,6 +1,17 @@
 import argparse
 import logging
-
+import sys
+from contextlib import redirect_stdout
+
+from coin_selection import AUTO, STRATEGIES, check_funds, plan_consolidation, select_sources, total_amount
+from constants import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, MAX_INPUTS_PER_TRANSACTION, VERIFY_CONCURRENCY, \
+    VERIFY_RETRIES
+from email_dispatcher import EmailDispatcher, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_CONNECTIONS, DEFAULT_RATE, \
+    SENT, SKIPPED, FAILED
+from input_validation import validate_input_file
+from journal import Journal, data_digest, SUBMITTING, SUBMITTED, SEND_FAILED, VERIFIED
+from progress import progress
+from settings import get_input, parse_settings
 from indy_helpers import *
 from utils import *
 
@@ -9,37 +20,28 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def parse_input_data(file) -> (dict, list):
-    logging.debug("Parse input CSV file: {}".format(args.dataFile))
+def parse_input_data(file, allow_duplicates=False) -> (dict, list):
+    logging.debug("Parse input CSV file: {}".format(file))
 
-    data = read_csv_file(file)
+    source, targets, errors = validate_input_file(file, allow_duplicates)
 
-    if len(data) == 0:
-        raise Exception('File is empty')
+    if errors:
+        for error in errors:
+            print(error)
+        raise Exception('Input file contains {} error(s)'.format(len(errors)))
+
+    return source, targets
 
-    owner_info = data.pop(0)
 
-    source = {
+def parse_sender_info(owner_info) -> dict:
+    return {
         'paymentAddress': owner_info[0],
         'walletId': owner_info[1],
         'walletPath': owner_info[2]
     }
 
-    if len(data) == 0:
-        raise Exception('There is no any target payment in the document')
-
-    targets = [
-        {
-            'legalName': row[0],
-            'tokensAmount': row[1],
-            'paymentAddress': row[2],
-            'email': row[3]
-        }
-        for row in data]
-    return source, targets
 
-
-def prepare_payment_data(source_payment_address, sources, targets):
+def prepare_payment_data(source_payment_address, sources, targets, strategy=AUTO):
     outputs = []
     required_tokens = 0
 
@@ -51,18 +53,9 @@ def prepare_payment_data(source_payment_address, sources, targets):
         })
         required_tokens += target_amount
 
-    inputs = []
-    source_amount = 0
-
-    for source in sources:
-        if source_amount < required_tokens:
-            inputs.append(source['source'])
-            source_amount += source['amount']
-        else:
-            break
-
-    if source_amount < required_tokens:
-        raise Exception('Insufficient funds on inputs: required: {}, source: {}'.format(required_tokens, source_amount))
+    selected = select_sources(sources, required_tokens, strategy)
+    inputs = [source['source'] for source in selected]
+    source_amount = total_amount(selected)
 
     if source_amount > required_tokens:
         outputs.append({
@@ -73,11 +66,50 @@ def prepare_payment_data(source_payment_address, sources, targets):
     return inputs, outputs
 
 
-def ask_user_confirmation():
-    answer = input("Would you like to continue? y/n     ")
-    if answer == 'y' or answer == 'yes':
-        pass
-    else:
+def prepare_payment_batches(source_payment_address, sources, targets, batch_size, strategy=AUTO):
+    # Every batch becomes one payment transaction paying at most 'batch_size'
+    # targets. Sources are handed out to the batches in order, each batch
+    # returning its own change to the source payment address.
+    if batch_size < 1:
+        raise Exception('Batch size must be at least 1')
+
+    check_funds(sources, sum(int(target['tokensAmount']) for target in targets))
+
+    batches = []
+    remaining_sources = list(sources)
+
+    for start in range(0, len(targets), batch_size):
+        batch_targets = targets[start:start + batch_size]
+        batch_tokens = sum(int(target['tokensAmount']) for target in batch_targets)
+
+        # Change only becomes spendable once a transaction is published, so
+        # each batch has to be covered by the sources no earlier batch took
+        if total_amount(remaining_sources) < batch_tokens:
+            raise Exception('Sources left after payment transaction {} cannot cover the next one. '
+                            'Consolidate the sources first or use a larger batch size'.format(len(batches)))
+
+        inputs, outputs = prepare_payment_data(source_payment_address, remaining_sources, batch_targets, strategy)
+
+        if len(inputs) > MAX_INPUTS_PER_TRANSACTION:
+            raise Exception('Payment transaction {} needs {} inputs, more than {} allowed. Use a smaller batch size'
+                            .format(len(batches) + 1, len(inputs), MAX_INPUTS_PER_TRANSACTION))
+
+        spent = set(inputs)
+        remaining_sources = [source for source in remaining_sources if source['source'] not in spent]
+        batches.append({
+            'inputs': inputs,
+            'outputs': outputs,
+            'targets': batch_targets
+        })
+
+    return batches
+
+
+def ask_user_confirmation(answer=None):
+    # 'answer' is the --yes setting, the user is asked if it is not set
+    if answer is None:
+        answer = input("Would you like to continue? y/n     ") in ('y', 'yes')
+    if not answer:
         raise Exception('Action has been interrupted')
 
 
@@ -101,22 +133,32 @@ def print_targets(items):
     print("Total number of tokens: " + str(total_tokens))
     print()
 
+    progress.emit('targets', targets=total_targets, tokens=total_tokens)
 
-def ensure_payment_transaction_result(pool_handle, response, targets):
-    logging.debug("Load Payment Library")
 
-    load_payment_plugin()
+def match_payment_receipts(response, targets):
+    # Returns the receipt of every target, in the order of 'targets'.
+    # Receipts are indexed once by recipient and amount, so a recipient paid
+    # several times in the same transaction gets one receipt per payment.
+    receipts_by_output = {}
+
+    for receipt in parse_payment_response(response):
+        receipts_by_output.setdefault((receipt['recipient'], int(receipt['amount'])), []).append(receipt['receipt'])
 
-    receipts = parse_payment_response(response)
     to_verifies = []
+    missing = []
 
     for target in targets:
-        matches = [receipt for receipt in receipts if target["paymentAddress"] == receipt['recipient']]
-        if len(matches) != 1:
-            raise Exception('Payment failed for {}'.format(target["paymentAddress"]))
-        to_verifies.append(matches[0]['receipt'])
+        matches = receipts_by_output.get((target["paymentAddress"], int(target['tokensAmount'])))
+        if not matches:
+            missing.append(target["paymentAddress"])
+            continue
+        to_verifies.append(matches.pop())
+
+    if missing:
+        raise Exception('Payment failed for {}'.format(', '.join(missing)))
 
-    verify_payment_on_ledger(pool_handle, to_verifies)
+    return to_verifies
 
 
 def prepare(args):
@@ -129,7 +171,7 @@ def prepare(args):
     #       Legal Name, Tokens Amount, Email, Payment Address
     #       .......
     #
-    # Pool Genesis Transactions - interactive input
+    # Pool Genesis Transactions - interactive input or --genesisFile
     #
     # Output - JSON file as ZIP archive
     # {
@@ -137,23 +179,31 @@ def prepare(args):
     #       walletId
     #       walletPath
     #   }
-    #   inputs
-    #   outputs
+    #   batches: [
+    #       {
+    #           inputs
+    #           outputs
+    #           targets
+    #       }
+    #   ]
     #   targets
     # }
+    out_dir = get_input(args, 'outputDir')
+
     print("Parsing input data from CSV file: \"{}\" ...".format(args.dataFile))
 
-    sender_info, targets = parse_input_data(args.dataFile)
+    with progress.phase('validate'):
+        sender_info, targets = parse_input_data(args.dataFile, args.allowDuplicates)
 
     print("The following list of target payments has been parsed")
 
     print_targets(targets)
 
-    ask_user_confirmation()
+    ask_user_confirmation(get_input(args, 'yes'))
 
     print("Connecting to Pool...")
 
-    pool_handle = open_pool()
+    pool_handle = open_pool(get_input(args, 'genesisFile'))
 
     logging.debug("Load Payment Library")
 
@@ -163,28 +213,118 @@ def prepare(args):
 
     logging.debug("Get payment sources for payment address \"{}\"".format(sender_info['paymentAddress']))
 
-    sources = get_payment_sources(pool_handle, sender_info['paymentAddress'])
+    with progress.phase('plan'):
+        sources = get_payment_sources(pool_handle, sender_info['paymentAddress'])
+
+        batches = prepare_payment_batches(sender_info['paymentAddress'], sources, targets, args.batchSize,
+                                          args.coinSelection)
+
+    print("Payments have been split into {} transaction(s)".format(len(batches)))
 
-    inputs, outputs = prepare_payment_data(sender_info['paymentAddress'], sources, targets)
+    progress.emit('transactions planned', transactions=len(batches), sources=len(sources))
 
     next_step_data = {
         'walletInfo': {
             'walletPath': sender_info['walletPath'],
             'walletId': sender_info['walletId']
         },
-        'inputs': inputs,
-        'outputs': outputs,
+        'batches': batches,
         'targets': targets,
     }
 
     print("Saving results into a file...")
 
-    store_zip_file(json.dumps(next_step_data))
+    progress.emit('file saved', file=store_zip_file(json.dumps(next_step_data), out_dir))
+
+    logging.debug("Closing pool...")
+
+    close_pool(pool_handle)
+
+
+def validate(args):
+    # Checks the input CSV file without connecting to the Pool
+    print("Validating input data from CSV file: \"{}\" ...".format(args.dataFile))
+
+    sender_info, targets = parse_input_data(args.dataFile, args.allowDuplicates)
+
+    tokens = sum(int(target['tokensAmount']) for target in targets)
+
+    print("Input file is valid: {} target payment(s), {} tokens in total".format(len(targets), tokens))
+
+    progress.emit('targets', targets=len(targets), tokens=tokens)
+
+
+def consolidate(args):
+    # Input:
+    # CSV File - only the first row (Payment Address, Wallet Id, Wallet Path) is used
+    #
+    # Pool Genesis Transactions - interactive input or --genesisFile
+    #
+    # Output - JSON file as ZIP archive in the format of the 'prepare' action,
+    # where every batch pays a group of the smallest sources (those below
+    # --consolidateBelow, if set) back to the payment address as a single source
+    out_dir = get_input(args, 'outputDir')
+
+    print("Parsing input data from CSV file: \"{}\" ...".format(args.dataFile))
+
+    data = read_csv_file(args.dataFile)
+
+    if len(data) == 0:
+        raise Exception('File is empty')
+
+    sender_info = parse_sender_info(data[0])
+
+    print("Connecting to Pool...")
+
+    pool_handle = open_pool(get_input(args, 'genesisFile'))
+
+    logging.debug("Load Payment Library")
+
+    load_payment_plugin()
+
+    sources = get_payment_sources(pool_handle, sender_info['paymentAddress'])
 
     logging.debug("Closing pool...")
 
     close_pool(pool_handle)
 
+    batches = plan_consolidation(sources, sender_info['paymentAddress'], MAX_INPUTS_PER_TRANSACTION,
+                                 below=args.consolidateBelow)
+
+    if not batches:
+        print("There are {} source(s) on the payment address. Nothing to consolidate".format(len(sources)))
+        return
+
+    for batch in batches:
+        batch['targets'] = [{
+            'legalName': 'Consolidation of {} sources'.format(len(batch['inputs'])),
+            'tokensAmount': str(batch['outputs'][0]['amount']),
+            'paymentAddress': sender_info['paymentAddress'],
+            'email': ''
+        }]
+
+    targets = [target for batch in batches for target in batch['targets']]
+
+    print("{} source(s) can be merged into {} by the following payments".format(
+        sum(len(batch['inputs']) for batch in batches), len(batches)))
+
+    print_targets(targets)
+
+    ask_user_confirmation(get_input(args, 'yes'))
+
+    next_step_data = {
+        'walletInfo': {
+            'walletPath': sender_info['walletPath'],
+            'walletId': sender_info['walletId']
+        },
+        'batches': batches,
+        'targets': targets,
+    }
+
+    print("Saving results into a file...")
+
+    progress.emit('file saved', file=store_zip_file(json.dumps(next_step_data), out_dir))
+
 
 def build(args):
     # Input:
@@ -194,18 +334,29 @@ def build(args):
     #       walletId
     #       walletPath
     #   }
-    #   inputs
-    #   outputs
+    #   batches: [
+    #       {
+    #           inputs
+    #           outputs
+    #           targets
+    #       }
+    #   ]
     #   targets
     # }
     #
-    # Wallet Key - interactive input
+    # Wallet Key - interactive input or walletKey setting
     #
     # Output - JSON file as ZIP archive
     # {
-    #   transaction
+    #   batches: [
+    #       {
+    #           transaction
+    #           targets
+    #       }
+    #   ]
     #   targets
     # }
+    out_dir = get_input(args, 'outputDir')
 
     print("Parsing input data from ZIP archive: \"{}\" ...".format(args.dataFile))
 
@@ -215,84 +366,261 @@ def build(args):
 
     print_targets(data['targets'])
 
-    ask_user_confirmation()
+    ask_user_confirmation(get_input(args, 'yes'))
 
     print("Opening wallet...")
 
-    wallet_handle = open_wallet(data['walletInfo'])
+    wallet_handle = open_wallet(data['walletInfo'], get_input(args, 'walletKey'))
 
     logging.debug("Load Payment Library")
 
     load_payment_plugin()
 
-    print("Building and Signing Payment Transaction...")
+    print("Building and Signing Payment Transactions...")
 
-    transaction = build_payment_request(wallet_handle, data['inputs'], data['outputs'])
+    signed_batches = []
+
+    with progress.phase('build'):
+        for batch in get_batches(data):
+            signed_batches.append({
+                'transaction': build_payment_request(wallet_handle, batch['inputs'], batch['outputs']),
+                'targets': batch['targets']
+            })
 
     logging.debug("Closing wallet")
 
     close_wallet(wallet_handle)
 
     next_step_data = {
-        'transaction': transaction,
+        'batches': signed_batches,
         'targets': data['targets']
     }
 
     print("Saving results into a file...")
 
-    store_zip_file(json.dumps(next_step_data))
+    progress.emit('file saved', file=store_zip_file(json.dumps(next_step_data), out_dir))
 
 
 def publish(args):
     # Input:
     # ZIP archive containing JSON File
     # {
-    #   transaction
+    #   batches: [
+    #       {
+    #           transaction
+    #           targets
+    #       }
+    #   ]
     #   targets
     # }
     # Email Info File
     #
-    # Pool Genesis Transactions - interactive input
+    # Pool Genesis Transactions - interactive input or --genesisFile
+    # Email Password - interactive input or emailPassword setting
+
+    email_password = get_input(args, 'emailPassword') if args.emailInfoFile else None
 
     print("Parsing input data from ZIP archive: \"{}\" ...".format(args.dataFile))
 
-    data = json.loads(read_zip_file(args.dataFile))
+    raw_data = read_zip_file(args.dataFile)
+    data = json.loads(raw_data)
 
     print("The following list of target payments has been parsed")
 
     print_targets(data['targets'])
 
-    ask_user_confirmation()
+    ask_user_confirmation(get_input(args, 'yes'))
+
+    batches = get_batches(data)
+
+    journal_file = args.journalFile or os.path.splitext(args.dataFile)[0] + '-journal.jsonl'
+    journal = Journal(journal_file, data_digest(raw_data))
+
+    try:
+        statuses = publish_batches(args, batches, journal)
+    finally:
+        journal.close()
+
+    paid_targets = [target for batch, status in zip(batches, statuses) if status == PAID for target in batch['targets']]
+
+    print_batch_statuses(batches, statuses)
+
+    email_log_file = args.emailLogFile or os.path.splitext(args.dataFile)[0] + '-emails.log'
+
+    with progress.phase('emails'):
+        send_emails(paid_targets, args.emailInfoFile, email_log_file, email_password)
+
+    failed = len(batches) - statuses.count(PAID)
+    if failed:
+        raise Exception('{} of {} payment transactions failed'.format(failed, len(batches)))
+
+
+def publish_batches(args, batches, journal):
+    # Sends and verifies every batch not completed by an earlier run, as
+    # recorded in the journal. Returns the status of every batch.
+    #
+    # A batch that was being sent when an earlier run stopped is sent again
+    # as the very same signed transaction, never rebuilt: the ledger either
+    # answers with the reply to the original request or rejects the spent
+    # inputs, so it cannot be paid twice.
+    states = journal.batch_states()
+    statuses = [None] * len(batches)
+    responses = [None] * len(batches)
+
+    for index in range(len(batches)):
+        state = states.get(index, {})
+        if VERIFIED in state and state[VERIFIED]['status'] == PAID:
+            statuses[index] = PAID
+        elif SUBMITTED in state:
+            responses[index] = state[SUBMITTED]['response']
+
+    to_send = [index for index in range(len(batches)) if statuses[index] is None and responses[index] is None]
+    to_verify = [index for index in range(len(batches)) if statuses[index] is None]
+
+    done = len(batches) - len(to_verify)
+    if done or len(to_send) < len(to_verify):
+        print("Journal \"{}\": {} payment transaction(s) already paid, {} sent but not verified".format(
+            journal.path, done, len(to_verify) - len(to_send)))
+
+    in_doubt = [index for index in to_send if SUBMITTING in states.get(index, {})]
+    if in_doubt:
+        print("Payment transaction(s) {} may have been sent by an earlier run and will be sent again unchanged".format(
+            ', '.join(str(index + 1) for index in in_doubt)))
+
+    if not to_verify:
+        return statuses
 
     print("Connecting to Pool...")
 
-    pool_handle = open_pool()
+    pool_handle = open_pool(get_input(args, 'genesisFile'))
+
+    logging.debug("Load Payment Library")
+
+    load_payment_plugin()
+
+    if to_send:
+        print("Sending {} Payment Transaction(s)...".format(len(to_send)))
 
-    print("Sending Payment Transaction...")
+        for index in to_send:
+            journal.record(SUBMITTING, batch=index)
 
-    response = send_transaction(pool_handle, data['transaction'])
+        def record_response(position, response):
+            index = to_send[position]
+            if isinstance(response, Exception):
+                journal.record(SEND_FAILED, batch=index, error=str(response))
+                progress.emit('transaction sent', transaction=index + 1, error=str(response))
+            else:
+                journal.record(SUBMITTED, batch=index, response=response)
+                progress.emit('transaction sent', transaction=index + 1, error=None)
 
-    print("Checking result of transaction...")
+        with progress.phase('send'):
+            sent = send_transactions(pool_handle, [batches[index]['transaction'] for index in to_send],
+                                     args.concurrency, record_response)
 
-    ensure_payment_transaction_result(pool_handle, response, data['targets'])
+        for index, response in zip(to_send, sent):
+            responses[index] = response
 
-    print("Sending emails to recipients...")
+    print("Checking result of transactions...")
 
-    send_emails(data['targets'], args.emailInfoFile)
+    # receipt -> (batch index, target)
+    receipt_targets = {}
+
+    for index in to_verify:
+        response = responses[index]
+        if isinstance(response, Exception):
+            statuses[index] = 'Failed to send: {}'.format(response)
+            continue
+        try:
+            receipts = match_payment_receipts(response, batches[index]['targets'])
+        except Exception as err:
+            statuses[index] = 'Failed: {}'.format(err)
+            continue
+        for target, receipt in zip(batches[index]['targets'], receipts):
+            receipt_targets[receipt] = (index, target)
+
+    verification_file = args.verificationFile or os.path.splitext(args.dataFile)[0] + '-verification.csv'
+
+    print("Verifying {} receipt(s), results are written to \"{}\" ...".format(len(receipt_targets), verification_file))
+
+    table = ResultTable(verification_file, VERIFICATION_COLUMNS)
+
+    def record_verification(result):
+        index, target = receipt_targets[result['receipt']]
+        table.write(dict(result, transaction=index + 1, recipient=target['paymentAddress'],
+                         tokensAmount=target['tokensAmount']))
+
+    try:
+        with progress.phase('verify'):
+            results = verify_payments(pool_handle, list(receipt_targets), args.verifyConcurrency, args.verifyRetries,
+                                      on_result=record_verification)
+    finally:
+        table.close()
+
+    unverified = {}
+    for result in results:
+        if result['status'] != RECEIPT_VERIFIED:
+            index, _ = receipt_targets[result['receipt']]
+            unverified[index] = unverified.get(index, 0) + 1
+
+    for index in to_verify:
+        if index in unverified:
+            statuses[index] = 'Failed to verify {} of {} receipt(s)'.format(
+                unverified[index], len(batches[index]['targets']))
+        elif statuses[index] is None:
+            statuses[index] = PAID
+        journal.record(VERIFIED, batch=index, status=statuses[index])
+        progress.emit('transaction verified', transaction=index + 1, status=statuses[index])
 
     logging.debug("Closing pool")
 
     close_pool(pool_handle)
 
+    return statuses
+
+
+PAID = 'Paid'
+
+VERIFICATION_COLUMNS = ['transaction', 'recipient', 'tokensAmount', 'receipt', 'status', 'attempts', 'error']
+
+
+def get_batches(data):
+    # Files written before payments were split into batches hold a single
+    # payment at the top level
+    if 'batches' in data:
+        return data['batches']
+    if 'transaction' in data:
+        return [{'transaction': data['transaction'], 'targets': data['targets']}]
+    return [{'inputs': data['inputs'], 'outputs': data['outputs'], 'targets': data['targets']}]
+
+
+def print_batch_statuses(batches, statuses):
+    delimiter = "-" * 150
+
+    print(delimiter)
+    print("{:<15} {:<15} {:<15} {:<60}".format('Transaction', 'Targets', 'Tokens Amount', 'Status'))
+    print(delimiter)
+    for number, (batch, status) in enumerate(zip(batches, statuses), 1):
+        tokens = sum(int(target['tokensAmount']) for target in batch['targets'])
+        print("{:<15} {:<15} {:<15} {:<60}".format(number, len(batch['targets']), tokens, status))
+    print(delimiter)
+    print()
+
+
+def send_emails(targets, email_info_file, email_log_file=None, password=None):
+    if email_info_file is None:
+        print("No --emailInfoFile given, email sending skipped")
+        return
+
+    print("Sending emails to recipients...")
 
-def send_emails(targets, email_info_file):
     try:
         email_info = json.loads(read_file(email_info_file))
-    except Exception as err:
+    except (OSError, ValueError) as err:
         print("No information for email sending found: {}".format(err))
         return
 
-    password = getpass("Enter Password for Email Account \"{}\":   ".format(email_info['from']))
+    if password is None:
+        password = getpass("Enter Password for Email Account \"{}\":   ".format(email_info['from']))
 
     print("-" * 50)
 
@@ -302,25 +630,114 @@ def send_emails(targets, email_info_file):
                }
                for target in targets if target['email']]
 
-    send_email(email_info['from'], targets, email_info['subject'], password)
+    dispatcher = EmailDispatcher(email_info['from'], password,
+                                 host=email_info.get('host', DEFAULT_HOST),
+                                 port=email_info.get('port', DEFAULT_PORT),
+                                 use_ssl=email_info.get('ssl', True),
+                                 connections=email_info.get('connections', DEFAULT_CONNECTIONS),
+                                 rate=email_info.get('rate', DEFAULT_RATE),
+                                 log_path=email_log_file)
+
+    def print_result(to, status, error):
+        if status == SENT:
+            print("Mail has been successfully sent to {}".format(to))
+        elif status == SKIPPED:
+            print("Mail has already been sent to {}".format(to))
+        else:
+            print("Sending email failed to {} with {}".format(to, error))
+
+    try:
+        results = dispatcher.send_all(targets, email_info['subject'], print_result)
+    except Exception as err:
+        print("Can not connect to email server " + str(err))
+        return
+
+    failed = [to for to, status, _ in results if status == FAILED]
+
+    progress.emit('emails sent', sent=sum(status == SENT for _, status, _ in results),
+                  skipped=sum(status == SKIPPED for _, status, _ in results), failed=len(failed))
+
+    if failed:
+        print("Sending email failed for {} of {} recipients. Run publish again to retry them".format(
+            len(failed), len(results)))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('action', default=None,
-                        choices=["prepare", "build", "publish"],
+                        choices=["validate", "prepare", "consolidate", "build", "publish"],
                         help="Type of action to perform")
     parser.add_argument('--dataFile',
                         help='[INPUT] file containing information required for action performing')
+    parser.add_argument('--config', default=None,
+                        help='[INPUT] JSON file with settings, keyed by option name (e.g. "genesisFile", '
+                             '"walletKey"). Options given on the command line or as TOKEN_DISTRIBUTION_<OPTION> '
+                             'environment variables take precedence')
+    parser.add_argument('--genesisFile', default=None,
+                        help='[prepare, consolidate, publish] Pool Genesis Transactions file (asked for if not set)')
+    parser.add_argument('--outputDir', default=None,
+                        help='[prepare, consolidate, build] directory result.zip is saved to (asked for if not set)')
+    parser.add_argument('--yes', action='store_true', default=None,
+                        help='continue without asking for confirmation')
+    parser.add_argument('--nonInteractive', action='store_true',
+                        help='never ask for input: a setting missing from the command line, environment and config '
+                             'file is an error')
+    parser.add_argument('--json', action='store_true',
+                        help='write progress to stdout as JSON lines, all other output goes to stderr')
     parser.add_argument('--emailInfoFile', default=None,
                         help='[INPUT] file containing information required for email sending')
-    args = parser.parse_args()
-
-    if args.action == 'prepare':
-        prepare(args)
-    elif args.action == 'build':
-        build(args)
-    elif args.action == 'publish':
-        publish(args)
-    else:
-        pass
+    parser.add_argument('--simulate', default=None, metavar='LEDGER_FILE',
+                        help='dry run against the simulated ledger kept in this file instead of a pool (see simulator.py)')
+    parser.add_argument('--allowDuplicates', action='store_true',
+                        help='[validate, prepare] allow paying the same payment address on several rows')
+    parser.add_argument('--batchSize', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='[prepare] maximum number of targets paid by one payment transaction')
+    parser.add_argument('--coinSelection', default=AUTO, choices=STRATEGIES,
+                        help='[prepare] how payment sources are chosen for each payment transaction')
+    parser.add_argument('--consolidateBelow', type=int, default=None, metavar='AMOUNT',
+                        help='[consolidate] only merge sources smaller than this amount (default: all sources)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='[publish] maximum number of payment transactions sent to the pool at the same time')
+    parser.add_argument('--verifyConcurrency', type=int, default=VERIFY_CONCURRENCY,
+                        help='[publish] maximum number of receipt verifications sent to the pool at the same time')
+    parser.add_argument('--verifyRetries', type=int, default=VERIFY_RETRIES,
+                        help='[publish] how often a receipt verification is retried after a pool timeout')
+    parser.add_argument('--emailLogFile', default=None,
+                        help='[OUTPUT] file recording every email sent, so a re-run only mails recipients not yet '
+                             'notified (default: next to --dataFile)')
+    parser.add_argument('--journalFile', default=None,
+                        help='[OUTPUT] journal of the publish progress, used to resume an interrupted publish '
+                             '(default: next to --dataFile)')
+    parser.add_argument('--verificationFile', default=None,
+                        help='[OUTPUT] CSV file the result of every receipt verification is appended to '
+                             '(default: next to --dataFile)')
+    args = parse_settings(parser)
+
+    if args.simulate:
+        import simulator
+        simulator.install(globals(), args.simulate)
+        # The simulated ledger needs neither genesis transactions nor a wallet key
+        args.genesisFile = '' if args.genesisFile is None else args.genesisFile
+        args.walletKey = '' if args.walletKey is None else args.walletKey
+
+    if args.json:
+        progress.enable(sys.stdout)
+
+    with redirect_stdout(sys.stderr if args.json else sys.stdout):
+        try:
+            with progress.phase(args.action):
+                if args.action == 'validate':
+                    validate(args)
+                elif args.action == 'prepare':
+                    prepare(args)
+                elif args.action == 'consolidate':
+                    consolidate(args)
+                elif args.action == 'build':
+                    build(args)
+                elif args.action == 'publish':
+                    publish(args)
+                else:
+                    pass
+        except Exception as err:
+            progress.emit('failed', phase=args.action, error=str(err))
+            raise
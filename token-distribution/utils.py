@@ -1,6 +1,5 @@
 import platform
 import asyncio
-import smtplib
 from ctypes import cdll
 from pathlib import Path
 import csv
@@ -32,10 +31,6 @@ def run_coroutine(coroutine):
     return loop.run_until_complete(coroutine)
 
 
-def run_array(array: list):
-    return run_coroutine(asyncio.wait(array))
-
-
 def read_file(data_file):
     with open(data_file, newline='') as data_file:
         return data_file.read()
@@ -55,8 +50,9 @@ def read_zip_file(path):
         return ifile.read().decode()
 
 
-def store_zip_file(data):
-    out_dir = input("Enter a path to save result:    ")
+def store_zip_file(data, out_dir=None) -> str:
+    if out_dir is None:
+        out_dir = input("Enter a path to save result:    ")
     out_file = os.path.join(out_dir, 'result.zip')
 
     with zipfile.ZipFile(out_file, 'w', zipfile.ZIP_DEFLATED) as file:
@@ -64,28 +60,26 @@ def store_zip_file(data):
 
     print("File has been create: {}".format(out_file))
 
+    return out_file
+
+
+class ResultTable:
+    # CSV file that every row is flushed to as soon as it is written, so the
+    # rows written so far survive if the script stops halfway
+
+    def __init__(self, path, columns):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.columns = columns
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction='ignore')
+        if new_file:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def write(self, row: dict):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
 
-def send_email(from_, targets, subject_, password):
-    try:
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.ehlo()
-        server.login(from_, password)
-    except Exception as err:
-        print("Can not connect to email server" + str(err))
-        return
-
-    for target in targets:
-        email_text = """\n\
-        From: %s
-        To: %s
-        Subject: %s
-
-        %s
-        """ % (from_, target['to'], subject_, target['body'])
-
-        try:
-            server.sendmail(from_, target['to'], email_text)
-            print("Mail has been successfully sent to {}".format(target['to']))
-        except Exception as err:
-            print("Sending email failed to {} with " + str(err))
-    server.close()